@@ -0,0 +1,325 @@
+# Import required packages / files
+from hybrid.hybrid import HybridSim
+from hybrid.abm import AgentBasedModel
+from sd.model import SDModel
+from core.kernels import resolve_backend
+import argparse
+import copy
+import importlib.metadata
+import json
+import math
+import os
+import platform
+import sys
+import time
+import numpy as np
+import scipy
+from scipy.stats import t
+
+# Folder results are saved to, independent of the working directory
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(
+	os.path.abspath(__file__))), 'benchmarks')
+
+def import_parameters():
+
+	json_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+							 '..', 'parameters', 'parameters.json')
+	with open(json_file, 'r', encoding='utf-8') as f:
+		parameters = json.load(f)
+
+	return parameters
+
+def measure(setup, run, warmup=1, repeats=10):
+	'''
+	Time a benchmark.
+
+	Parameters
+	----------
+	setup : callable
+		Builds fresh state for one run; not timed.
+	run : callable
+		run(state), the code being timed.
+	warmup : int, optional
+		Number of untimed runs first. Default is 1.
+	repeats : int, optional
+		Number of timed runs. Default is 10.
+
+	Returns
+	-------
+	array_like, shape (repeats,)
+		Wall time of each timed run in seconds.
+	'''
+
+	for _ in range(warmup):
+		run(setup())
+
+	times = np.empty(repeats)
+	for i in range(repeats):
+		state = setup()
+		start = time.perf_counter()
+		run(state)
+		times[i] = time.perf_counter() - start
+
+	return times
+
+def summarise(times):
+	'''
+	Summary statistics of the run times of a benchmark.
+
+	Parameters
+	----------
+	times : array_like, shape (n,)
+		Wall time of each timed run in seconds.
+
+	Returns
+	-------
+	dict
+		Mean with a 95% confidence interval (t-distribution), standard
+		deviation, median, minimum and the individual times.
+	'''
+
+	n = len(times)
+	mean = float(np.mean(times))
+	std = float(np.std(times, ddof=1)) if n > 1 else 0.0
+	bound = std / math.sqrt(n) * t.ppf(0.975, df=n-1) if n > 1 else 0.0
+
+	return {'mean': mean, 'lower': mean - bound, 'upper': mean + bound,
+			'std': std, 'median': float(np.median(times)),
+			'min': float(np.min(times)), 'repeats': n,
+			'times': [float(x) for x in times]}
+
+def benchmarks(parameters, quick=False):
+	'''
+	Benchmarks of the hot paths of the models.
+
+	Parameters
+	----------
+	parameters : dict
+		Parameters of the models.
+	quick : bool, optional
+		Use smaller sizes only. Default is False.
+
+	Returns
+	-------
+	dict
+		setup and run callables (see measure) keyed by benchmark name. If
+		numba is installed, benchmarks ending in -numba repeat others with
+		the compiled kernels.
+	'''
+
+	compiled = resolve_backend('auto') == 'numba'
+	sd_pars = parameters['system_dynamics']
+	abm_pars = parameters['agent_based']
+	horizon = parameters['general']['horizon']
+	cases = {}
+
+	# System dynamics model for each method of modelling the pipeline delay
+	def sd_case(method, **options):
+		pars = dict(sd_pars, **options)
+		solver = pars.pop('solver', 'LSODA')
+		backend = pars.pop('backend', 'numpy')
+		return (lambda: SDModel(copy.deepcopy(pars), method, solver=solver,
+								backend=backend),
+				lambda model: model.solve(horizon))
+	cases['sd/interp'] = sd_case('interp')
+	cases['sd/interp-rk4'] = sd_case('interp', solver='RK4')
+	for order in [1, 10, 100] if quick else [1, 10, 100, 1000]:
+		cases[f'sd/lct-{order}'] = sd_case('LCT', delay_order=order)
+	if compiled:
+		cases['sd/interp-numba'] = sd_case('interp', backend='numba')
+		cases['sd/interp-rk4-numba'] = sd_case('interp', solver='RK4',
+											   backend='numba')
+		cases['sd/lct-100-numba'] = sd_case('LCT', delay_order=100,
+											backend='numba')
+
+	# Infections over the horizon as a proportion of the population
+	model = SDModel(copy.deepcopy(sd_pars), 'interp')
+	model.solve(horizon)
+	prevalence = model.interpolator(np.arange(horizon))[1] / sd_pars['population']
+
+	# Agent-based model for each population size
+	def abm_pars_for(population, **options):
+		scale = population / sd_pars['population']
+		return dict(abm_pars, **options,
+					max_daily_vax=max(1, round(abm_pars['max_daily_vax'] * scale)))
+
+	def generate(population):
+		return (lambda: AgentBasedModel(abm_pars_for(population), 0),
+				lambda model: model.generate_agents(population))
+
+	def steps(population, **options):
+		def setup():
+			model = AgentBasedModel(abm_pars_for(population, **options), 0)
+			model.generate_agents(population)
+			return model
+		def run(model):
+			for infections in prevalence * population:
+				model.daily_step(infections)
+		return setup, run
+
+	for population in [10**3, 10**4] if quick else [10**3, 10**4, 10**5]:
+		cases[f'abm/generate-{population}'] = generate(population)
+		cases[f'abm/steps-{population}'] = steps(population)
+
+	# Daily step partitioned across every core
+	cases[f'abm/steps-{population}-partitioned'] = \
+	steps(population, workers=os.cpu_count() or 1)
+	if compiled:
+		cases[f'abm/steps-{population}-numba'] = steps(population,
+													   backend='numba')
+		cases[f'abm/steps-{population}-partitioned-numba'] = \
+		steps(population, workers=os.cpu_count() or 1, backend='numba')
+
+	# Hybrid model end to end
+	def hybrid_case(method, backend='numpy', **options):
+		pars = copy.deepcopy(parameters)
+		pars['system_dynamics'].update(method=method, backend=backend,
+									   **options)
+		pars['agent_based']['backend'] = backend
+		pars['general']['main_seed'] = 0
+		return (lambda: HybridSim(copy.deepcopy(pars)),
+				lambda model: model.simulate())
+	cases['hybrid/interp'] = hybrid_case('interp')
+	cases['hybrid/lct-100'] = hybrid_case('LCT', delay_order=100)
+	if compiled:
+		cases['hybrid/interp-numba'] = hybrid_case('interp', 'numba')
+		cases['hybrid/lct-100-numba'] = hybrid_case('LCT', 'numba',
+													delay_order=100)
+
+	return cases
+
+def run_benchmarks(output, warmup=1, repeats=10, select=None, quick=False):
+	'''
+	Run the benchmarks and save the results as JSON.
+
+	Parameters
+	----------
+	output : str
+		File the results are saved to.
+	warmup, repeats : int, optional
+		Passed to measure. Defaults are 1 and 10.
+	select : str, optional
+		Only run benchmarks whose name contains this text.
+	quick : bool, optional
+		Use smaller sizes only. Default is False.
+
+	Returns
+	-------
+	dict
+		Environment, summary of every benchmark and, for each benchmark
+		repeated with the compiled kernels, the speed-up over the NumPy
+		path.
+	'''
+
+	compiled = resolve_backend('auto') == 'numba'
+	results = {'environment': {'python': platform.python_version(),
+							   'numpy': np.__version__,
+							   'scipy': scipy.__version__,
+							   'numba': importlib.metadata.version('numba')
+							   if compiled else None,
+							   'platform': platform.platform(),
+							   'processor': platform.processor(),
+							   'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+			   'benchmarks': {}}
+
+	for name, (setup, run) in benchmarks(import_parameters(), quick).items():
+		if select and select not in name:
+			continue
+		summary = summarise(measure(setup, run, warmup, repeats))
+		results['benchmarks'][name] = summary
+		print(f"{name:<24} {summary['mean']*1000:10.2f} ms "
+			  f"[{summary['lower']*1000:.2f}, {summary['upper']*1000:.2f}]")
+
+	# Compiled kernels against the NumPy path
+	results['speedups'] = {}
+	for name, summary in results['benchmarks'].items():
+		base = name.removesuffix('-numba')
+		if base != name and base in results['benchmarks']:
+			speedup = results['benchmarks'][base]['mean'] / summary['mean']
+			results['speedups'][base] = speedup
+			print(f'{base:<24} numba {speedup:.2f}x the speed of numpy')
+
+	if os.path.dirname(output):
+		os.makedirs(os.path.dirname(output), exist_ok=True)
+	with open(output, 'w', encoding='utf-8') as f:
+		json.dump(results, f, indent=1)
+
+	return results
+
+def compare(baseline, current, threshold=0.1):
+	'''
+	Compare benchmark results against a baseline.
+
+	A benchmark has regressed if its mean is more than threshold slower
+	than the baseline and the confidence intervals do not overlap, and has
+	improved in the opposite case.
+
+	Parameters
+	----------
+	baseline, current : str
+		Files of results saved by run_benchmarks.
+	threshold : float, optional
+		Relative change in the mean that is ignored. Default is 0.1.
+
+	Returns
+	-------
+	list of str
+		Names of the benchmarks that regressed.
+	'''
+
+	with open(baseline, 'r', encoding='utf-8') as f:
+		old = json.load(f)['benchmarks']
+	with open(current, 'r', encoding='utf-8') as f:
+		new = json.load(f)['benchmarks']
+
+	regressions = []
+	for name in new:
+		if name not in old:
+			print(f'{name:<24} (no baseline)')
+			continue
+		a, b = old[name], new[name]
+		ratio = b['mean'] / a['mean']
+		if ratio > 1 + threshold and b['lower'] > a['upper']:
+			status = 'REGRESSION'
+			regressions.append(name)
+		elif ratio < 1 / (1 + threshold) and b['upper'] < a['lower']:
+			status = 'improved'
+		else:
+			status = 'unchanged'
+		print(f"{name:<24} {a['mean']*1000:10.2f} ms -> {b['mean']*1000:10.2f} ms "
+			  f"({ratio:.2f}x) {status}")
+
+	return regressions
+
+def main():
+
+	parser = argparse.ArgumentParser(
+		description='Benchmark the system dynamics, agent-based and hybrid '
+					'models.')
+	commands = parser.add_subparsers(dest='command', required=True)
+
+	run = commands.add_parser('run', help='run the benchmarks')
+	run.add_argument('--output',
+					 default=os.path.join(BENCHMARKS, 'latest.json'))
+	run.add_argument('--warmup', type=int, default=1)
+	run.add_argument('--repeats', type=int, default=10)
+	run.add_argument('--select', help='only run benchmarks containing this')
+	run.add_argument('--quick', action='store_true',
+					 help='smaller sizes only')
+
+	comp = commands.add_parser('compare',
+							   help='flag regressions against a baseline')
+	comp.add_argument('baseline')
+	comp.add_argument('current')
+	comp.add_argument('--threshold', type=float, default=0.1)
+
+	args = parser.parse_args()
+	if args.command == 'run':
+		run_benchmarks(args.output, args.warmup, args.repeats, args.select,
+					   args.quick)
+	else:
+		if compare(args.baseline, args.current, args.threshold):
+			sys.exit(1)
+
+if __name__ == '__main__':
+	main()
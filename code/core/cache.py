@@ -0,0 +1,289 @@
+# Import required packages
+import numpy as np
+import hashlib
+import json
+import os
+import shutil
+import uuid
+import warnings
+
+class ArrayCache:
+	'''
+	On-disk cache of named arrays, keyed by JSON-serialisable settings.
+
+	Each entry is a directory of .npy files together with a meta.json file
+	recording the key and a checksum of every array. Entries are written to
+	a temporary folder and renamed into place, and arrays are opened with
+	mmap_mode='r', so processes on the same node share one read-only copy
+	through the page cache.
+
+	Attributes
+	----------
+	directory : str
+		Folder holding the cache entries.
+	max_bytes : int
+		Total size the cache is trimmed to, evicting the least recently
+		used entries first.
+	verify : bool
+		Check the checksums of an entry before its first use in a process.
+	'''
+
+	# Bumped whenever the layout changes
+	version = 1
+
+	def __init__(self, directory, max_bytes=2**32, verify=True):
+		'''
+		Initialise an array cache.
+
+		Parameters
+		----------
+		directory : str
+			Folder holding the cache entries. Created if needed.
+		max_bytes : int, optional
+			Total size the cache is trimmed to. Default is 4 GiB.
+		verify : bool, optional
+			Check the checksums of an entry before its first use in a
+			process. Default is True.
+		'''
+
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.verify = verify
+		os.makedirs(self.directory, exist_ok=True)
+
+		# Entries already verified by this process
+		self._verified = set()
+
+	def __getstate__(self):
+		'''
+		Do not send the record of verified entries to other processes.
+		'''
+
+		state = self.__dict__.copy()
+		state['_verified'] = set()
+		return state
+
+	def entry_name(self, key):
+		'''
+		Return the name of the entry for a key.
+
+		Parameters
+		----------
+		key : dict
+			JSON-serialisable settings that determine the arrays.
+
+		Returns
+		-------
+		str
+			Hash of the canonical form of the key.
+		'''
+
+		canonical = json.dumps({'version': self.version, 'key': key},
+							   sort_keys=True, separators=(',', ':'))
+		return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+	def get_or_create(self, key, create):
+		'''
+		Load the arrays for a key, generating and storing them if needed.
+
+		Parameters
+		----------
+		key : dict
+			JSON-serialisable settings that determine the arrays.
+		create : callable
+			Called without arguments to generate a dict of arrays on a miss.
+
+		Returns
+		-------
+		dict
+			Read-only memory-mapped arrays.
+		'''
+
+		arrays = self.load(key)
+		if arrays is None:
+			self.store(key, create())
+			arrays = self.load(key)
+			self.evict(keep=self.entry_name(key))
+
+		return arrays
+
+	def load(self, key):
+		'''
+		Open the arrays stored for a key.
+
+		Parameters
+		----------
+		key : dict
+			JSON-serialisable settings that determine the arrays.
+
+		Returns
+		-------
+		dict or None
+			Read-only memory-mapped arrays, or None if there is no valid
+			entry. Entries that fail the checks are removed with a warning.
+		'''
+
+		name = self.entry_name(key)
+		path = os.path.join(self.directory, name)
+		meta_file = os.path.join(path, 'meta.json')
+		if not os.path.exists(meta_file):
+			return None
+
+		try:
+			with open(meta_file, 'r', encoding='utf-8') as f:
+				meta = json.load(f)
+			if meta['version'] != self.version or meta['key'] != key:
+				raise ValueError('key does not match')
+			if self.verify and name not in self._verified:
+				for array, checksum in meta['checksums'].items():
+					if file_checksum(os.path.join(path, f'{array}.npy')) \
+					!= checksum:
+						raise ValueError(f'checksum of {array} does not match')
+				self._verified.add(name)
+			arrays = {array: np.load(os.path.join(path, f'{array}.npy'),
+									 mmap_mode='r')
+					  for array in meta['checksums']}
+		except (OSError, ValueError, KeyError) as error:
+			warnings.warn(f'Discarding cache entry {name}: {error}.')
+			shutil.rmtree(path, ignore_errors=True)
+			return None
+
+		# Record the access for eviction
+		os.utime(meta_file)
+
+		return arrays
+
+	def store(self, key, arrays):
+		'''
+		Write the arrays for a key.
+
+		Parameters
+		----------
+		key : dict
+			JSON-serialisable settings that determine the arrays.
+		arrays : dict
+			Arrays to store.
+		'''
+
+		def create(allocate):
+			for array, values in arrays.items():
+				values = np.ascontiguousarray(values)
+				allocate(array, values.shape, values.dtype)[...] = values
+
+		self.write(key, create)
+
+	def write(self, key, create):
+		'''
+		Write the entry for a key, with its arrays filled in place.
+
+		The entry is written to a temporary folder and renamed into place,
+		so concurrent readers never see a partial entry.
+
+		Parameters
+		----------
+		key : dict
+			JSON-serialisable settings that determine the arrays.
+		create : callable
+			Called as create(allocate), where allocate(name, shape, dtype)
+			returns a writable memory-mapped array stored in the entry.
+		'''
+
+		name = self.entry_name(key)
+		path = os.path.join(self.directory, name)
+		tmp = os.path.join(self.directory, f'.tmp-{name}-{uuid.uuid4().hex}')
+		os.makedirs(tmp)
+
+		arrays = {}
+		def allocate(array, shape, dtype):
+			array_file = os.path.join(tmp, f'{array}.npy')
+			if np.prod(shape) == 0:
+				# Empty arrays cannot be memory-mapped
+				np.save(array_file, np.empty(shape, dtype=dtype))
+				return np.empty(shape, dtype=dtype)
+			arrays[array] = np.lib.format.open_memmap(array_file, mode='w+',
+													  dtype=dtype, shape=shape)
+			return arrays[array]
+		create(allocate)
+
+		for values in arrays.values():
+			values.flush()
+		arrays.clear()
+		checksums = {array[:-len('.npy')]: file_checksum(os.path.join(tmp, array))
+					 for array in sorted(os.listdir(tmp))}
+
+		meta = {'version': self.version, 'key': key, 'checksums': checksums}
+		with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+			json.dump(meta, f)
+
+		try:
+			os.rename(tmp, path)
+			self._verified.add(name)
+		except OSError:
+			# Another process stored the same entry first
+			shutil.rmtree(tmp, ignore_errors=True)
+
+	def entries(self):
+		'''
+		Return the stored entries.
+
+		Returns
+		-------
+		list of tuple
+			Name, last access time and size in bytes of every entry.
+		'''
+
+		entries = []
+		for name in os.listdir(self.directory):
+			path = os.path.join(self.directory, name)
+			meta_file = os.path.join(path, 'meta.json')
+			if name.startswith('.') or not os.path.exists(meta_file):
+				continue
+			size = sum(os.path.getsize(os.path.join(path, x))
+					   for x in os.listdir(path))
+			entries.append((name, os.path.getmtime(meta_file), size))
+
+		return entries
+
+	def evict(self, keep=None):
+		'''
+		Remove least recently used entries until the cache fits max_bytes.
+
+		Parameters
+		----------
+		keep : str, optional
+			Name of an entry that must not be removed.
+		'''
+
+		entries = sorted(self.entries(), key=lambda x: x[1])
+		total = sum(x[2] for x in entries)
+		for name, _, size in entries:
+			if total <= self.max_bytes:
+				break
+			if name == keep:
+				continue
+			# Open memory maps keep working after the files are unlinked
+			shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+			self._verified.discard(name)
+			total -= size
+
+def file_checksum(path):
+	'''
+	Return the SHA-256 checksum of a file.
+
+	Parameters
+	----------
+	path : str
+		File to hash.
+
+	Returns
+	-------
+	str
+		Hexadecimal digest.
+	'''
+
+	digest = hashlib.sha256()
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(2**24), b''):
+			digest.update(block)
+
+	return digest.hexdigest()
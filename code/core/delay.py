@@ -0,0 +1,165 @@
+# Import required packages
+import numpy as np
+
+class DelayHistory:
+	'''
+	Fast lookup of one component of a dense solution at lagged times.
+
+	The right-hand side of a delay equation with a constant lag reads the
+	solution at t - lag for every evaluation, and successive evaluations
+	fall in the same or the next solver step. The segment used last is
+	therefore cached, and only the requested component is clipped and
+	returned, without the generic dispatch of DenseSolution.__call__.
+	Values are clipped to the bounds of the solution in the same way.
+
+	Attributes
+	----------
+	solution : DenseSolution
+		Dense solution to read from.
+	component : int or array_like of int
+		Index (or indices) of the component returned.
+	segment : int
+		Segment used by the last scalar lookup.
+	'''
+
+	def __init__(self, solution, component):
+		'''
+		Initialise a delay history.
+
+		Parameters
+		----------
+		solution : DenseSolution
+			Dense solution to read from. It may still be extended.
+		component : int or array_like of int
+			Index (or indices) of the component returned.
+		'''
+
+		self.solution = solution
+		self.component = component
+		self.segment = 0
+
+	def __call__(self, t):
+		'''
+		Return the component at a singular or array of time points.
+
+		Parameters
+		----------
+		t : float or array_like, shape (n,)
+			Time points, already shifted by the lag.
+
+		Returns
+		-------
+		float or array_like, shape (n,)
+			Values of the component, with a leading axis for each index if
+			component is an array.
+		'''
+
+		if np.ndim(t) == 0:
+			value = self.evaluate(self.find(t), t)
+		else:
+			t = np.asarray(t, dtype=float)
+			segments = self.solution.segment(t)
+			value = np.empty(np.shape(self.component) + t.shape)
+			for segment in np.unique(segments):
+				mask = segments == segment
+				value[..., mask] = self.evaluate(segment, t[mask])
+
+		return self.clip(value)
+
+	def find(self, t):
+		'''
+		Index of the segment used at a single time point.
+
+		Parameters
+		----------
+		t : float
+			Time point.
+
+		Returns
+		-------
+		int
+			Segment index, as chosen by OdeSolution.
+		'''
+
+		breaks = self.solution.breaks.data
+		segment = self.segment
+		n_segments = self.solution.n_segments
+
+		# Reuse the cached segment, or the one after it, when possible
+		if segment < n_segments and breaks[segment] < t <= breaks[segment+1]:
+			return segment
+		if segment + 1 < n_segments and \
+		breaks[segment+1] < t <= breaks[segment+2]:
+			self.segment = segment + 1
+			return self.segment
+
+		self.segment = int(self.solution.segment(t))
+		return self.segment
+
+	def evaluate(self, segment, t):
+		'''
+		Evaluate the component on one segment.
+
+		Parameters
+		----------
+		segment : int
+			Segment index.
+		t : float or array_like, shape (n,)
+			Time points within the segment.
+
+		Returns
+		-------
+		float or array_like, shape (n,)
+			Values of the component.
+		'''
+
+		interpolant = self.solution.interpolants[segment]
+
+		# Evaluate LSODA's Nordsieck history directly, skipping the checks of
+		# DenseOutput.__call__. The product with the full history is kept (it
+		# is only n_states x order) so results match OdeSolution exactly.
+		if hasattr(interpolant, 'yh'):
+			if np.ndim(t) == 0:
+				x = ((t - interpolant.t) / interpolant.h) ** interpolant.p
+			else:
+				x = ((t - interpolant.t) / interpolant.h) ** \
+				interpolant.p[:, None]
+			return np.dot(interpolant.yh, x)[self.component]
+
+		return interpolant(t)[self.component]
+
+	def trim(self, t):
+		'''
+		Drop the segments of the solution before time t, keeping the cached
+		segment in step.
+
+		Parameters
+		----------
+		t : float
+			Earliest time still to be looked up.
+		'''
+
+		dropped = self.solution.trim(t)
+		self.segment = max(self.segment - dropped, 0)
+
+	def clip(self, value):
+		'''
+		Adjust values in line with the bounds of the solution.
+
+		Parameters
+		----------
+		value : float or array_like, shape (n,)
+			Values of the component.
+
+		Returns
+		-------
+		float or array_like, shape (n,)
+			Bounded values.
+		'''
+
+		lower = self.solution.lower
+		upper = self.solution.upper
+		if lower is not None or upper is not None:
+			value = np.clip(value, lower, upper)
+
+		return value
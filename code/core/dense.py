@@ -0,0 +1,192 @@
+# Import required packages
+import numpy as np
+from itertools import groupby
+from core.history import History
+
+class DenseSolution:
+	'''
+	Append-only dense output of a solution made up of solver steps.
+
+	Behaves like scipy's OdeSolution, but new steps are appended in
+	amortised O(1) instead of rebuilding the whole object from concatenated
+	time points and interpolants after every solve. Segments are found by
+	binary search over the step boundaries.
+
+	Attributes
+	----------
+	ts : array_like, shape (n_segments+1,)
+		Boundaries of the segments.
+	interpolants : list of DenseOutput
+		Interpolant of every segment.
+	n_segments : int
+		Number of segments.
+	t_min, t_max : float
+		Time range covered.
+	lower, upper : float or None
+		Bounds values are clipped to, if given.
+	'''
+
+	def __init__(self, ts, interpolants, bounds=None):
+		'''
+		Initialise a dense solution.
+
+		Parameters
+		----------
+		ts : array_like, shape (n_segments+1,)
+			Increasing boundaries of the segments.
+		interpolants : list of DenseOutput
+			Interpolant of every segment.
+		bounds : array_like, shape (2,), optional
+			Lower and upper bounds values are clipped to (to account for
+			error).
+		'''
+
+		self.breaks = History(ts[0], capacity=max(2 * len(ts), 16))
+		self.interpolants = []
+		self.extend(ts, interpolants)
+
+		# Stock bounds
+		self.lower, self.upper = bounds if bounds is not None else (None, None)
+
+	@property
+	def ts(self):
+		'''
+		Boundaries of the segments.
+		'''
+
+		return self.breaks.view
+
+	@property
+	def n_segments(self):
+		'''
+		Number of segments.
+		'''
+
+		return len(self.interpolants)
+
+	@property
+	def t_min(self):
+		'''
+		Start of the time range covered.
+		'''
+
+		return self.breaks.data[0]
+
+	@property
+	def t_max(self):
+		'''
+		End of the time range covered.
+		'''
+
+		return self.breaks.data[self.breaks.size - 1]
+
+	def extend(self, ts, interpolants):
+		'''
+		Append solver steps.
+
+		Parameters
+		----------
+		ts : array_like, shape (m+1,)
+			Boundaries of the new steps; ts[0] must be the current end.
+		interpolants : list of DenseOutput
+			Interpolant of every new step.
+		'''
+
+		if len(ts) != len(interpolants) + 1:
+			raise ValueError('ts must have one more element than interpolants.')
+		if ts[0] != self.t_max or np.any(np.diff(ts) <= 0):
+			raise ValueError('ts must continue the solution and be increasing.')
+
+		for t, interpolant in zip(ts[1:], interpolants):
+			self.breaks.append(t)
+			self.interpolants.append(interpolant)
+
+	def trim(self, t):
+		'''
+		Drop the segments before the one used at time t, to bound memory
+		when only recent values are needed.
+
+		Parameters
+		----------
+		t : float
+			Earliest time still to be evaluated.
+
+		Returns
+		-------
+		int
+			Number of segments dropped.
+		'''
+
+		first = int(self.segment(t))
+		if first > 0:
+			size = self.breaks.size - first
+			self.breaks.data[:size] = self.breaks.data[first:self.breaks.size]
+			self.breaks.size = size
+			del self.interpolants[:first]
+
+		return first
+
+	def segment(self, t):
+		'''
+		Index of the segment used at time(s) t.
+
+		Parameters
+		----------
+		t : float or array_like, shape (n,)
+			Time points.
+
+		Returns
+		-------
+		int or array_like, shape (n,)
+			Segment indices, as chosen by OdeSolution.
+		'''
+
+		segments = np.searchsorted(self.ts, t, side='left') - 1
+
+		return np.clip(segments, 0, self.n_segments - 1)
+
+	def __call__(self, t):
+		'''
+		Return interpolated value(s) at a singular or array of time points.
+		Adjust the values in line with the bounds, if given.
+
+		Parameters
+		----------
+		t : float or array_like, shape (n,)
+			Singular or array of time points to solve at.
+
+		Returns
+		-------
+		array_like, shape (n_states,) or (n_states, n)
+			Interpolated values.
+		'''
+
+		t = np.asarray(t)
+
+		if t.ndim == 0:
+			vals = self.interpolants[int(self.segment(t))](t)
+		else:
+			# Evaluate each segment once on its sorted group of time points
+			order = np.argsort(t)
+			reverse = np.empty_like(order)
+			reverse[order] = np.arange(order.shape[0])
+			t_sorted = t[order]
+			segments = self.segment(t_sorted)
+
+			ys = []
+			group_start = 0
+			for segment, group in groupby(segments):
+				group_end = group_start + len(list(group))
+				y = self.interpolants[segment](t_sorted[group_start:group_end])
+				ys.append(y)
+				group_start = group_end
+
+			vals = np.hstack(ys)[:, reverse]
+
+		# Adjust in line with boundaries if specified
+		if self.lower is not None:
+			vals[(vals < self.lower)] = self.lower
+		if self.upper is not None:
+			vals[(vals > self.upper)] = self.upper
+
+		return vals
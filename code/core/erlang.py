@@ -0,0 +1,201 @@
+# Import required packages
+import numpy as np
+from scipy.sparse import csc_matrix
+
+# Bandwidths of the Jacobian approximation passed to LSODA
+LOWER_BAND = 3
+UPPER_BAND = 3
+
+def erlang_chain(Z, inflow, rate):
+	'''
+	Rates of change of the stages of an Erlang (linear chain trick) delay.
+
+	Parameters
+	----------
+	Z : array_like, shape (n,)
+		Stage values.
+	inflow : float
+		Flow into the first stage.
+	rate : float
+		Rate at which each stage empties, order / delay length.
+
+	Returns
+	-------
+	dZdt : array_like, shape (n,)
+		Rates of change of the stages.
+	outflow : float
+		Flow out of the final stage.
+	'''
+
+	flows = rate * Z
+	dZdt = np.empty_like(flows)
+	dZdt[0] = inflow
+	dZdt[1:] = flows[:-1]
+	dZdt -= flows
+
+	return dZdt, flows[-1]
+
+def siqr_jacobian(y, contact_rate, infectivity, quarantine_fraction,
+				  infectivity_length, symptom_delay, vaccine_uptake=0):
+	'''
+	Partial derivatives of the S, I, Q and R equations with respect to the
+	main stocks, excluding the outflow of the pipeline delay.
+
+	Parameters
+	----------
+	y : array_like, shape (4+n,) or (4, m)
+		Stock values, or the main stocks of m models stacked by column.
+	contact_rate, infectivity, quarantine_fraction : float or array_like
+		Model parameters, one per model if stacked.
+	infectivity_length, symptom_delay : float or array_like
+		Model parameters, one per model if stacked.
+	vaccine_uptake : float, optional
+		Proportion vaccinated per day. Default is 0.
+
+	Returns
+	-------
+	array_like, shape (4, 4) or (4, 4, m)
+		Jacobian block J[i, j] = d(dy_i/dt) / dy_j.
+	'''
+
+	S, I, Q, R = y[:4]
+
+	# Derivatives of the infection rate
+	beta = contact_rate * infectivity / (S + I + R)**2
+	dIR_dS = beta * I * (I + R)
+	dIR_dI = beta * S * (S + R)
+	dIR_dR = -beta * S * I
+
+	# Recovery and quarantine rates
+	recovery = (1-quarantine_fraction) / infectivity_length
+	quarantine = quarantine_fraction / symptom_delay
+
+	block = np.zeros((4, 4) + np.shape(beta))
+	block[0, 0] = -dIR_dS - vaccine_uptake
+	block[0, 1] = -dIR_dI
+	block[0, 3] = -dIR_dR
+	block[1, 0] = dIR_dS
+	block[1, 1] = dIR_dI - recovery - quarantine
+	block[1, 3] = dIR_dR
+	block[2, 1] = quarantine
+	block[3, 0] = vaccine_uptake
+	block[3, 1] = recovery
+
+	return block
+
+def lct_jacobian(block, order, rate):
+	'''
+	Sparse Jacobian of the model using the linear chain trick.
+
+	Parameters
+	----------
+	block : array_like, shape (4, 4)
+		Jacobian of the main stocks from siqr_jacobian.
+	order : int
+		Order of the Erlang delay.
+	rate : float
+		Rate at which each stage empties, order / delay length.
+
+	Returns
+	-------
+	csc_matrix, shape (4+order, 4+order)
+		Jacobian J[i, j] = d(dy_i/dt) / dy_j.
+	'''
+
+	rows, cols = lct_pattern(order)
+	values = np.concatenate((
+		block.ravel(),
+		[block[2, 1]],
+		np.full(order, -rate),
+		np.full(order - 1, rate),
+		[-rate, rate]))
+
+	return csc_matrix((values, (rows, cols)), shape=(4+order, 4+order))
+
+def lct_pattern(order):
+	'''
+	Row and column indices of the Jacobian entries used by lct_jacobian.
+
+	Parameters
+	----------
+	order : int
+		Order of the Erlang delay.
+
+	Returns
+	-------
+	rows, cols : array_like, shape (2*order + 18,)
+		Indices of the main block, the chain and the delay outflow.
+	'''
+
+	stages = np.arange(4, 4 + order)
+	last = 3 + order
+	rows = np.concatenate((np.repeat(np.arange(4), 4), [4], stages,
+						   stages[1:], [2, 3]))
+	cols = np.concatenate((np.tile(np.arange(4), 4), [1], stages,
+						   stages[:-1], [last, last]))
+
+	return rows, cols
+
+def lct_sparsity(order):
+	'''
+	Sparsity pattern of the Jacobian using the linear chain trick.
+
+	Suitable as jac_sparsity for the BDF and Radau methods of solve_ivp.
+
+	Parameters
+	----------
+	order : int
+		Order of the Erlang delay.
+
+	Returns
+	-------
+	csc_matrix, shape (4+order, 4+order)
+		Ones where the Jacobian may be nonzero.
+	'''
+
+	rows, cols = lct_pattern(order)
+	pattern = csc_matrix((np.ones(len(rows)), (rows, cols)),
+						 shape=(4+order, 4+order))
+	pattern.data[:] = 1
+
+	return pattern
+
+def lct_banded_jacobian(block, order, rate):
+	'''
+	Banded Jacobian of the model using the linear chain trick, packed for
+	LSODA with lband=LOWER_BAND and uband=UPPER_BAND.
+
+	Apart from the main block, the Jacobian is bidiagonal. The only entries
+	outside the band are those of Q and R with respect to the final stage.
+	They are left out: Q and R do not feed back into the chain, so Newton's
+	method still converges and error control keeps the solution accurate,
+	while each LU factorisation costs time linear in the order.
+
+	Parameters
+	----------
+	block : array_like, shape (4, 4)
+		Jacobian of the main stocks from siqr_jacobian.
+	order : int
+		Order of the Erlang delay.
+	rate : float
+		Rate at which each stage empties, order / delay length.
+
+	Returns
+	-------
+	array_like, shape (LOWER_BAND+UPPER_BAND+1, 4+order)
+		Packed Jacobian, packed[UPPER_BAND + i - j, j] = J[i, j].
+	'''
+
+	packed = np.zeros((LOWER_BAND + UPPER_BAND + 1, 4 + order))
+
+	# Main block
+	for i in range(4):
+		for j in range(4):
+			packed[UPPER_BAND + i - j, j] = block[i, j]
+
+	# First stage fed by I, then the bidiagonal chain
+	packed[UPPER_BAND + 3, 1] = block[2, 1]
+	packed[UPPER_BAND, 4:] = -rate
+	packed[UPPER_BAND + 1, 4:-1] = rate
+
+	return packed
@@ -0,0 +1,177 @@
+# Import required packages
+import numpy as np
+from scipy.interpolate import CubicHermiteSpline
+from core.history import History
+
+class FixedStepDelaySolver:
+	'''
+	Classical fourth-order Runge-Kutta solver for a delay equation with one
+	constant lag in one component.
+
+	The step size divides the lag, so the lagged values needed by each step
+	lie on the grid (or halfway between two grid points). Only the last
+	steps_per_lag + 1 values of the lagged component, with their
+	derivatives, are kept in a ring buffer and read by index. Midpoint
+	values come from cubic Hermite interpolation, which matches the order
+	of the method.
+
+	The right-hand side is discontinuous at t0 + lag, where the lagged term
+	switches on. As the breakpoint is a grid point, every step lies on one
+	side of it: steps before it use a lagged value of zero for all stages,
+	including the final stage evaluated at the breakpoint itself.
+
+	Attributes
+	----------
+	h : float
+		Step size, lag / steps_per_lag.
+	t : float
+		Current time.
+	y : array_like, shape (n,)
+		Current state.
+	steps : int
+		Number of steps taken.
+	'''
+
+	def __init__(self, fun, t0, y0, lag, steps_per_lag, component=1):
+		'''
+		Initialise the solver.
+
+		Parameters
+		----------
+		fun : callable
+			Right-hand side fun(t, y, lagged), where lagged is the value of
+			the component at t - lag, or 0 before the breakpoint.
+		t0 : float
+			Initial time.
+		y0 : array_like, shape (n,)
+			Initial state.
+		lag : float
+			Constant lag.
+		steps_per_lag : int
+			Number of steps per lag.
+		component : int, optional
+			Index of the lagged component. Default is 1.
+		'''
+
+		if not isinstance(steps_per_lag, int) or steps_per_lag < 1:
+			raise ValueError('steps_per_lag must be a positive integer.')
+
+		self.fun = fun
+		self.t0 = t0
+		self.t = t0
+		self.y = np.asarray(y0, dtype=float)
+		self.h = lag / steps_per_lag
+		self.m = steps_per_lag
+		self.component = component
+		self.steps = 0
+
+		# Ring buffer of the lagged component and its derivative
+		self.ring_y = np.zeros(self.m + 1)
+		self.ring_f = np.zeros(self.m + 1)
+
+		# Grid solution for dense output
+		self.ts = History(t0, capacity=256)
+		self.ys = History(self.y, capacity=256)
+		self.fs = None
+
+	def lagged(self, offset):
+		'''
+		Value of the lagged component for a stage of the current step.
+
+		Parameters
+		----------
+		offset : float
+			Position of the stage within the step: 0, 0.5 or 1.
+
+		Returns
+		-------
+		float
+			Component at t + offset*h - lag, or 0 before the breakpoint.
+		'''
+
+		if self.steps < self.m:
+			return 0.0
+
+		j0 = (self.steps - self.m) % (self.m + 1)
+		j1 = (self.steps - self.m + 1) % (self.m + 1)
+		if offset == 0:
+			return self.ring_y[j0]
+		if offset == 1:
+			return self.ring_y[j1]
+
+		# Cubic Hermite interpolation at the midpoint
+		return 0.5 * (self.ring_y[j0] + self.ring_y[j1]) + \
+		self.h / 8 * (self.ring_f[j0] - self.ring_f[j1])
+
+	def derivative(self):
+		'''
+		Right-hand side at the current time and state.
+
+		Returns
+		-------
+		array_like, shape (n,)
+			Rates of change.
+		'''
+
+		return self.fun(self.t, self.y, self.lagged(0))
+
+	def step(self):
+		'''
+		Take one RK4 step.
+		'''
+
+		t, y, h = self.t, self.y, self.h
+
+		k1 = self.derivative()
+
+		# Record the grid point before reading later stages, which may need it
+		slot = self.steps % (self.m + 1)
+		self.ring_y[slot] = y[self.component]
+		self.ring_f[slot] = k1[self.component]
+		if self.fs is None:
+			self.fs = History(k1, capacity=256)
+		else:
+			self.fs.append(k1)
+
+		lagged_mid = self.lagged(0.5)
+		k2 = self.fun(t + h/2, y + h/2 * k1, lagged_mid)
+		k3 = self.fun(t + h/2, y + h/2 * k2, lagged_mid)
+		k4 = self.fun(t + h, y + h * k3, self.lagged(1))
+
+		self.y = y + h/6 * (k1 + 2*k2 + 2*k3 + k4)
+		self.steps += 1
+		self.t = self.t0 + self.steps * h
+		self.ts.append(self.t)
+		self.ys.append(self.y)
+
+	def advance(self, t):
+		'''
+		Step until time t, which must lie on the grid.
+
+		Parameters
+		----------
+		t : float
+			Time to stop at.
+		'''
+
+		steps = (t - self.t0) / self.h
+		if abs(steps - round(steps)) > 1e-9 * max(1, abs(steps)):
+			raise ValueError('t must be a multiple of the step size from t0.')
+
+		while self.steps < round(steps):
+			self.step()
+
+	def dense_output(self):
+		'''
+		Piecewise cubic Hermite interpolant of the grid solution.
+
+		Returns
+		-------
+		CubicHermiteSpline
+			Callable returning the state at a singular or array of time
+			points, with shape (n,) or (n, n_points).
+		'''
+
+		fs = np.concatenate((self.fs.view, [self.derivative()]))
+
+		return CubicHermiteSpline(self.ts.view, self.ys.view.T, fs.T, axis=1)
@@ -0,0 +1,96 @@
+# Import required packages
+import numpy as np
+
+class History:
+	'''
+	Record of values over time with preallocated storage.
+
+	Rows are written into a preallocated array whose capacity doubles when
+	it is exceeded, so appending is amortised O(1) rather than copying the
+	whole record each time as np.append and np.vstack do.
+
+	Attributes
+	----------
+	data : array_like, shape (capacity, ...)
+		Underlying storage; only the first size rows are in use.
+	size : int
+		Number of rows recorded.
+	'''
+
+	def __init__(self, initial, capacity=16, dtype=float):
+		'''
+		Initialise a record with its first row.
+
+		Parameters
+		----------
+		initial : float or array_like
+			First row of the record.
+		capacity : int, optional
+			Number of rows to preallocate. Default is 16.
+		dtype : data-type, optional
+			Type of the recorded values. Default is float.
+		'''
+
+		initial = np.asarray(initial, dtype=dtype)
+		self.data = np.empty((max(capacity, 1),) + initial.shape, dtype=dtype)
+		self.data[0] = initial
+		self.size = 1
+
+	def __len__(self):
+		'''
+		Return the number of rows recorded.
+		'''
+
+		return self.size
+
+	def reserve(self, capacity):
+		'''
+		Make room for at least capacity rows.
+
+		Parameters
+		----------
+		capacity : int
+			Total number of rows expected.
+		'''
+
+		if capacity > len(self.data):
+			self.resize(capacity)
+
+	def resize(self, capacity):
+		'''
+		Move the record into storage with room for capacity rows.
+
+		Parameters
+		----------
+		capacity : int
+			New number of rows to allocate.
+		'''
+
+		data = np.empty((capacity,) + self.data.shape[1:], dtype=self.data.dtype)
+		data[:self.size] = self.data[:self.size]
+		self.data = data
+
+	def append(self, values):
+		'''
+		Record a new row, doubling the storage if it is full.
+
+		Parameters
+		----------
+		values : float or array_like
+			Row to record.
+		'''
+
+		if self.size == len(self.data):
+			self.resize(2 * len(self.data))
+		self.data[self.size] = values
+		self.size += 1
+
+	@property
+	def view(self):
+		'''
+		Read-only view of the recorded rows.
+		'''
+
+		view = self.data[:self.size]
+		view.flags.writeable = False
+		return view
@@ -0,0 +1,141 @@
+# Import required packages
+import numpy as np
+from scipy.integrate import LSODA
+
+class PersistentLSODA(LSODA):
+	'''
+	LSODA solver that is kept alive across coupling steps.
+
+	Instead of starting a new solve_ivp call for every step of a hybrid
+	model, the solver is advanced to each coupling time in turn. It never
+	steps past the coupling time, so a parameter changed there is a clean
+	discontinuity. After such a change the solver is restarted cheaply from
+	its current state, reusing the last step size rather than estimating a
+	tiny initial step again.
+
+	Attributes
+	----------
+	restarts : int
+		Number of restarts at discontinuities.
+	'''
+
+	def __init__(self, fun, t0, y0, t_bound, **options):
+		'''
+		Initialise the solver.
+
+		Parameters
+		----------
+		fun : callable
+			Right-hand side of the system, fun(t, y).
+		t0 : float
+			Initial time.
+		y0 : array_like, shape (n,)
+			Initial state.
+		t_bound : float
+			First coupling time.
+		**options
+			Passed to scipy.integrate.LSODA.
+		'''
+
+		super().__init__(fun, t0, y0, t_bound, **options)
+		self.restarts = 0
+
+		# Kept to rebuild the solver when it is copied
+		self.rhs = fun
+		self.options = options
+
+	def __getstate__(self):
+		'''
+		State of the solver as plain data, for copying and pickling.
+
+		The wrappers scipy builds around the right-hand side are closures
+		that cannot be copied, so the solver is rebuilt from the right-hand
+		side and options, and its integration state (including the LSODA
+		work arrays and saved common block) is restored on top.
+		'''
+
+		solver = self._lsoda_solver
+		return {'rhs': self.rhs, 'options': self.options,
+				'attributes': {key: getattr(self, key) for key in
+							   ['t_old', 't', 'y', 't_bound', 'direction',
+								'status', 'nfev', 'njev', 'nlu', 'restarts']},
+				'solver': {'_y': solver._y, 't': solver.t,
+						   'stiff': solver.stiff},
+				'integrator': vars(solver._integrator)}
+
+	def __setstate__(self, state):
+		'''
+		Rebuild the solver from the state returned by __getstate__.
+		'''
+
+		attributes = state['attributes']
+		self.__init__(state['rhs'], attributes['t'], attributes['y'],
+					  attributes['t_bound'], **state['options'])
+		self.__dict__.update(attributes)
+
+		solver = self._lsoda_solver
+		for key, value in state['solver'].items():
+			setattr(solver, key, value)
+
+		# Copy into the existing work arrays, which call_args refers to
+		integrator = solver._integrator
+		for key, value in state['integrator'].items():
+			current = getattr(integrator, key, None)
+			if key == 'call_args':
+				for i, arg in enumerate(value):
+					if isinstance(current[i], np.ndarray):
+						current[i][...] = arg
+					else:
+						current[i] = arg
+			elif isinstance(current, np.ndarray) and \
+			np.shape(current) == np.shape(value):
+				current[...] = value
+			else:
+				setattr(integrator, key, value)
+
+	def advance(self, t):
+		'''
+		Integrate up to time t exactly.
+
+		Parameters
+		----------
+		t : float
+			Coupling time to stop at.
+
+		Returns
+		-------
+		ts : list of float
+			Start time followed by the end time of every step taken.
+		interpolants : list of DenseOutput
+			Dense output of every step taken.
+		'''
+
+		# Move the critical time (itask=5) to the new coupling time
+		integrator = self._lsoda_solver._integrator
+		self.t_bound = t
+		integrator.rwork[0] = t
+		self.status = 'running'
+
+		ts = [self.t]
+		interpolants = []
+		while self.status == 'running':
+			message = self.step()
+			if self.status == 'failed':
+				raise RuntimeError(f'LSODA failed at t={self.t}: {message}')
+			ts.append(self.t)
+			interpolants.append(self.dense_output())
+
+		return ts, interpolants
+
+	def restart(self):
+		'''
+		Restart from the current state after a discontinuity.
+
+		LSODA is reinitialised (istate=1) at the current time and state with
+		the last successful step size as its first step.
+		'''
+
+		integrator = self._lsoda_solver._integrator
+		integrator.rwork[4] = integrator.rwork[10]
+		integrator.call_args[3] = 1
+		self.restarts += 1
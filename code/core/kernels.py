@@ -0,0 +1,160 @@
+# Import required packages
+import importlib.util
+import warnings
+import numpy as np
+
+# Kernels compiled with numba, on first use
+compiled = None
+
+def resolve_backend(name):
+	'''
+	Resolve the backend requested for a model.
+
+	Parameters
+	----------
+	name : str
+		'numpy' (the NumPy code paths), 'numba' (compiled kernels) or 'auto'
+		(numba if it is installed, numpy otherwise).
+
+	Returns
+	-------
+	str
+		'numpy' or 'numba'. A request for numba falls back to numpy, with a
+		warning, when numba is not installed.
+	'''
+
+	if name not in ['numpy', 'numba', 'auto']:
+		raise ValueError('Backend must be numpy, numba or auto.')
+	if name == 'numpy':
+		return 'numpy'
+	if importlib.util.find_spec('numba') is not None:
+		return 'numba'
+	if name == 'numba':
+		warnings.warn('numba is not installed, using the numpy backend.')
+
+	return 'numpy'
+
+def kernels():
+	'''
+	Compile the kernels with numba, once per process.
+
+	Compiled code is cached next to this file, so later processes load it
+	rather than compiling again. The kernels release the GIL, so the
+	threads of the chunked daily step run them in parallel.
+
+	Returns
+	-------
+	dict
+		Compiled siqr_rhs and influence_candidates.
+	'''
+
+	global compiled
+	if compiled is None:
+		import numba
+		compiled = {name: numba.njit(cache=True, nogil=True)(function)
+					for name, function
+					in [('siqr_rhs', siqr_rhs),
+						('influence_candidates', influence_candidates)]}
+
+	return compiled
+
+def siqr_rhs(y, contact_rate, infectivity, quarantine_fraction,
+			 infectivity_length, symptom_delay, vaccine_uptake, rate, outflow):
+	'''
+	Right-hand side of the stock equations, with the Erlang stages of the
+	LCT method if y has any.
+
+	Written as loops for numba. The operations are those of the NumPy
+	stock equations in the same order, so the results are the same.
+
+	Parameters
+	----------
+	y : array_like, shape (4+n,)
+		Stock values, followed by n >= 0 Erlang stages.
+	contact_rate, infectivity, quarantine_fraction : float
+		Model parameters.
+	infectivity_length, symptom_delay : float
+		Model parameters.
+	vaccine_uptake : float
+		Proportion vaccinated per day.
+	rate : float
+		Rate at which each Erlang stage empties (unused without stages).
+	outflow : float
+		Flow out of quarantine, used when there are no stages.
+
+	Returns
+	-------
+	array_like, shape (4+n,)
+		Rates of change.
+	'''
+
+	dydt = np.empty(y.shape[0])
+	S, I, R = y[0], y[1], y[3]
+
+	# Standard flows
+	VR = vaccine_uptake * S
+	IR = (contact_rate * infectivity * S * I) / (S + I + R)
+	IRR = ((1-quarantine_fraction) * I) / infectivity_length
+	QR = (quarantine_fraction * I) / symptom_delay
+
+	# Erlang stages
+	if y.shape[0] > 4:
+		inflow = QR
+		for k in range(4, y.shape[0]):
+			flow = rate * y[k]
+			dydt[k] = inflow - flow
+			inflow = flow
+		outflow = inflow
+
+	dydt[0] = - IR - VR
+	dydt[1] = IR - IRR - QR
+	dydt[2] = QR - outflow
+	dydt[3] = VR + IRR + outflow
+
+	return dydt
+
+def influence_candidates(agents, thresholds, vaccinated, vaccinated_friends,
+						 indptr, cutoff, social_weight):
+	'''
+	Unvaccinated agents whose total influence exceeds their threshold.
+
+	Written as a loop for numba, with the same arithmetic as the NumPy
+	daily steps.
+
+	Parameters
+	----------
+	agents : array_like, shape (m,)
+		Agents to test.
+	thresholds : array_like, shape (population,)
+		Vaccination thresholds.
+	vaccinated : array_like, shape (population,)
+		Vaccination status, 1 is vaccinated.
+	vaccinated_friends : array_like, shape (population,)
+		Number of vaccinated friends of each agent.
+	indptr : array_like, shape (population+1,)
+		CSR row pointers of the social network.
+	cutoff : float
+		Weighted influence from the number of infections.
+	social_weight : float
+		Weight of the social influence, 1 - weight.
+
+	Returns
+	-------
+	array_like, shape (n,)
+		Candidates, in the order of agents.
+	'''
+
+	candidates = np.empty(agents.shape[0], dtype=np.int64)
+	n = 0
+	for agent in agents:
+		if vaccinated[agent] != 0:
+			continue
+		social_influence = 0.0
+		if vaccinated_friends[agent] > 0:
+			social_influence = vaccinated_friends[agent] / \
+			(indptr[agent + 1] - indptr[agent])
+		if cutoff + social_weight * social_influence > thresholds[agent]:
+			candidates[n] = agent
+			n += 1
+
+	return candidates[:n]
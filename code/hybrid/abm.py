@@ -1,8 +1,13 @@
 # Import required packages/files
 import numpy as np
-from sim_tools.distributions import Beta, spawn_seeds
-import networkx as nx
+from concurrent.futures import ThreadPoolExecutor
+from hybrid.network import (newman_watts_strogatz,
+							networkx_newman_watts_strogatz, to_networkx,
+							csr_rows)
+from hybrid.store import PopulationStore
 import math
+from core.history import History
+from core.kernels import resolve_backend, kernels
 
 class Agent:
 	'''
@@ -75,12 +80,57 @@ class AgentBasedModel:
 		Random number generator for sampling agents.
 	daily_vax : array_like, shape (n,)
 		Number of vaccinations each day.
+	vax_history : History
+		Record of daily vaccinations, read through daily_vax.
 	population : int
 		Total number of agents in the population.
 	agent_list : array_like, shape (population,)
 		List of agents.
-	social_network : Newman-Watts-Strogartz graph object
-		Graph representing the social network of the population.
+	network : str
+		Generator for the social network, either 'native' (CSR arrays built
+		directly) or 'networkx'. Default is 'native'.
+	network_k : int
+		Number of nearest neighbours in the ring lattice, at least 2 so
+		every agent has friends. Default is 4.
+	network_p : float
+		Probability of adding a shortcut for each ring edge. Default is 0.1.
+	engine : str
+		Implementation of the daily step, either 'object' (one Agent per
+		individual), 'array' (NumPy arrays) or 'mmap' (arrays in
+		memory-mapped files of a PopulationStore, processed in chunks).
+		Default is 'array'.
+	chunk_size : int
+		Agents processed at a time by the chunked daily step. Default is
+		65536.
+	workers : int
+		Threads the chunked daily step runs on. The mmap engine always uses
+		the chunked step, and the array engine uses it when workers is more
+		than 1. Default is 1.
+	abm_backend : str
+		Either 'numpy' (the default) or 'numba', which tests agents against
+		their thresholds with a compiled kernel (array and mmap engines
+		only).
+	thresholds : array_like, shape (population,)
+		Vaccination thresholds (array and mmap engines only).
+	vaccinated : array_like, shape (population,)
+		Vaccination status, 1 is vaccinated (array and mmap engines only).
+	indptr : array_like, shape (population+1,)
+		CSR row pointers of the social network.
+	indices : array_like, shape (2*edges,)
+		CSR column indices of the social network.
+	vaccinated_friends : array_like, shape (population,)
+		Running count of each agent's vaccinated friends (array and mmap
+		engines only).
+	threshold_order : array_like, shape (population,)
+		Agents sorted by threshold (array engine only).
+	frontier : array_like, shape (n,)
+		Unvaccinated agents with at least one vaccinated friend (array
+		engine only).
+	chunk_min_threshold : array_like, shape (chunks,)
+		Lowest threshold in each chunk (chunked daily step only).
+	chunk_social_max : array_like, shape (chunks,)
+		Upper bound on the social influence in each chunk (chunked daily
+		step only).
 	'''
 
 	def __init__(self, parameters, main_seed):
@@ -91,7 +141,9 @@ class AgentBasedModel:
 		----------
 		parameters : dict
 			Dictionary containing values for max_daily_vax, influence_param, 
-			beta_params, weight.
+			beta_params, weight and optionally engine, chunk_size, workers,
+			backend ('numpy', 'numba' or 'auto'; see
+			core.kernels.resolve_backend), network, network_k, network_p.
 		main_seed : int
 			Seed for reproducibility.
 		'''
@@ -105,7 +157,33 @@ class AgentBasedModel:
 		else:
 			raise ValueError('Weight must be between 0 and 1.')
 
-		# Store seeds
+		# Implementation of the daily step
+		engine = parameters.get('engine', 'array')
+		if engine in ['object', 'array', 'mmap']:
+			self.engine = engine
+		else:
+			raise ValueError('Engine must be object, array or mmap.')
+		self.chunk_size = parameters.get('chunk_size', 2**16)
+		self.workers = parameters.get('workers', 1)
+		self.abm_backend = resolve_backend(parameters.get('backend', 'numpy'))
+
+		# Social network generator
+		network = parameters.get('network', 'native')
+		if network == 'native' or network == 'networkx':
+			self.network = network
+		else:
+			raise ValueError('Network must either be native or networkx.')
+		self.network_k = parameters.get('network_k', 4)
+		if self.network_k < 2:
+			# Agents without friends have no social influence, which the
+			# engines would treat differently
+			raise ValueError('Network k must be at least 2.')
+		self.network_p = parameters.get('network_p', 0.1)
+
+		# Store seeds (sim_tools is imported here as it loads matplotlib and
+		# scipy.stats, which models not using the ABM do not need)
+		from sim_tools.distributions import spawn_seeds
+		self.main_seed = main_seed
 		self.seeds = spawn_seeds(4, main_seed)
 
 		# Generators for sampling agents
@@ -113,9 +191,17 @@ class AgentBasedModel:
 		self.dead_generator = np.random.default_rng(self.seeds[1])
 
 		# Store daily vaccinations
-		self.daily_vax = np.array([0])
+		self.vax_history = History(0, dtype=np.int64)
 
-	def generate_agents(self, population):
+	@property
+	def daily_vax(self):
+		'''
+		Number of vaccinations each day.
+		'''
+
+		return self.vax_history.view
+
+	def generate_agents(self, population, cache=None):
 		'''
 		Generate a set of agents and create a social network. 
 
@@ -123,6 +209,10 @@ class AgentBasedModel:
 		----------
 		population : int
 			Number of agents in the population.
+		cache : PopulationCache, optional
+			Cache of generated populations. Thresholds and the network are
+			loaded from it when available, and stored in it otherwise. The
+			mmap engine needs a PopulationStore.
 
 		Notes
 		-----
@@ -144,29 +234,232 @@ class AgentBasedModel:
 		# Number of agents to generate
 		self.population = population
 
-		# Randomly draw thresholds from Unif(0,1)
-		threshold_dist = Beta(alpha1=self.beta_params[0], 
-							  alpha2=self.beta_params[1],
-							  random_seed=self.seeds[2])
-		thresholds = threshold_dist.sample(self.population)
+		# Population generated into and read from memory-mapped files
+		if self.engine == 'mmap':
+			if not isinstance(cache, PopulationStore):
+				raise ValueError('The mmap engine needs a PopulationStore.')
+			arrays = cache.get_or_create(self.population_key(),
+										 self.write_population)
+			self.init_store(arrays, cache)
+			return
+
+		# Thresholds and friendship network
+		if cache:
+			arrays = cache.get_or_create(self.population_key(),
+										 self.generate_population)
+		else:
+			arrays = self.generate_population()
+		thresholds = arrays['thresholds']
+		self.indptr = arrays['indptr']
+		self.indices = arrays['indices']
+
+		if self.engine == 'array':
+			self.init_arrays(thresholds, self.indptr, self.indices,
+							 arrays['threshold_order'],
+							 arrays['sorted_thresholds'])
+			return
 
 		# Create agents
 		self.agent_list = []
 		for i in range(self.population):
 			self.agent_list.append(Agent(thresholds[i]))
 
+		# Store friends as an attribute
+		for i, agent in enumerate(self.agent_list):
+			friends = self.indices[self.indptr[i]:self.indptr[i+1]]
+			agent.add_friends([self.agent_list[j] for j in friends])
+
+	def to_networkx(self):
+		'''
+		Export the social network as a networkx graph.
+
+		Returns
+		-------
+		Graph object
+			Graph whose node i is the agent with index i.
+		'''
+
+		return to_networkx(self.indptr, self.indices)
+
+	def generate_population(self):
+		'''
+		Draw thresholds and generate the social network.
+
+		Returns
+		-------
+		dict
+			Arrays thresholds, indptr, indices, threshold_order and
+			sorted_thresholds.
+		'''
+
+		# Randomly draw thresholds from Unif(0,1)
+		from sim_tools.distributions import Beta
+		threshold_dist = Beta(alpha1=self.beta_params[0], 
+							  alpha2=self.beta_params[1],
+							  random_seed=self.seeds[2])
+		thresholds = np.asarray(threshold_dist.sample(self.population),
+								dtype=float)
+		threshold_order = np.argsort(thresholds, kind='stable')
+
 		# Generate friendship network
 		graph_generator = np.random.default_rng(self.seeds[3])
-		self.social_network = nx.newman_watts_strogatz_graph(population, 4, 0.1,
-															seed=graph_generator)
-		labels = dict(zip(range(self.population), self.agent_list))
-		nx.relabel_nodes(self.social_network, labels, copy=False)
+		if self.network == 'native':
+			indptr, indices = newman_watts_strogatz(
+				self.population, self.network_k, self.network_p,
+				seed=graph_generator)
+		else:
+			indptr, indices = networkx_newman_watts_strogatz(
+				self.population, self.network_k, self.network_p,
+				seed=graph_generator)
 
-		# Store friends as an attribute
-		for i in self.agent_list:
-			i.add_friends([j for j in self.social_network.neighbors(i)])
+		return {'thresholds': thresholds,
+				'indptr': indptr,
+				'indices': indices,
+				'threshold_order': threshold_order,
+				'sorted_thresholds': thresholds[threshold_order]}
+
+	def write_population(self, allocate):
+		'''
+		Draw thresholds and generate the social network into arrays
+		allocated by a PopulationStore.
+
+		Thresholds are drawn in chunks, which gives the same values as one
+		sample, and stored as float32; the network is the same as the one
+		generate_population returns.
+
+		Parameters
+		----------
+		allocate : callable
+			Called as allocate(name, shape, dtype) to return the array
+			'thresholds', 'indptr' or 'indices' is written into.
+		'''
+
+		# Randomly draw thresholds, a chunk at a time
+		from sim_tools.distributions import Beta
+		threshold_dist = Beta(alpha1=self.beta_params[0], 
+							  alpha2=self.beta_params[1],
+							  random_seed=self.seeds[2])
+		thresholds = allocate('thresholds', (self.population,), np.float32)
+		for start in range(0, self.population, self.chunk_size):
+			stop = min(start + self.chunk_size, self.population)
+			thresholds[start:stop] = threshold_dist.sample(stop - start)
+
+		# Generate friendship network
+		graph_generator = np.random.default_rng(self.seeds[3])
+		if self.network == 'native':
+			newman_watts_strogatz(self.population, self.network_k,
+								  self.network_p, seed=graph_generator,
+								  allocate=allocate)
+		else:
+			arrays = networkx_newman_watts_strogatz(
+				self.population, self.network_k, self.network_p,
+				seed=graph_generator)
+			for name, values in zip(['indptr', 'indices'], arrays):
+				allocate(name, values.shape, values.dtype)[...] = values
+
+	def population_key(self):
+		'''
+		Return the settings that determine the generated population.
+
+		Returns
+		-------
+		dict
+			Population size, beta_params, network generator, network_k,
+			network_p and main_seed, and the precision of the thresholds
+			for the mmap engine.
+		'''
+
+		key = {'population': int(self.population),
+			   'beta_params': [float(x) for x in self.beta_params],
+			   'network': self.network,
+			   'network_k': int(self.network_k),
+			   'network_p': float(self.network_p),
+			   'main_seed': int(self.main_seed)}
+		if self.engine == 'mmap':
+			key['thresholds'] = 'float32'
+
+		return key
+
+	def init_arrays(self, thresholds, indptr, indices, threshold_order=None,
+					sorted_thresholds=None):
+		'''
+		Set up the state of the array engine.
+
+		Parameters
+		----------
+		thresholds : array_like, shape (population,)
+			Individual thresholds for becoming vaccinated.
+		indptr : array_like, shape (population+1,)
+			CSR row pointers of the social network.
+		indices : array_like, shape (2*edges,)
+			CSR column indices of the social network.
+		threshold_order : array_like, shape (population,), optional
+			Agents sorted by threshold. Computed if not given.
+		sorted_thresholds : array_like, shape (population,), optional
+			Thresholds in sorted order. Computed if not given.
+		'''
+
+		# Store thresholds, statuses and the network as arrays
+		self.thresholds = np.asarray(thresholds, dtype=float)
+		self.vaccinated = np.zeros(self.population, dtype=np.int8)
+		self.indptr = indptr
+		self.indices = indices
+		self.degree = np.diff(self.indptr)
+
+		# Threshold-sorted index for candidate detection
+		if threshold_order is None:
+			threshold_order = np.argsort(self.thresholds, kind='stable')
+		if sorted_thresholds is None:
+			sorted_thresholds = self.thresholds[threshold_order]
+		self.threshold_order = threshold_order
+		self.sorted_thresholds = sorted_thresholds
+
+		# Incrementally tracked social influence
+		self.vaccinated_friends = np.zeros(self.population, dtype=np.int32)
+		self.frontier = np.zeros(0, dtype=np.int64)
+
+		# Partitioned daily step
+		if self.workers > 1:
+			self.init_chunks()
+
+	def init_store(self, arrays, store):
+		'''
+		Set up the state of the mmap engine.
+
+		Parameters
+		----------
+		arrays : dict
+			Memory-mapped thresholds, indptr and indices.
+		store : PopulationStore
+			Store holding the scratch files for the vaccination state.
+		'''
+
+		# Population and network stay in their files
+		self.thresholds = arrays['thresholds']
+		self.indptr = arrays['indptr']
+		self.indices = arrays['indices']
+
+		# Statuses and counts of vaccinated friends in scratch files, with
+		# the store kept for the scratch files of snapshots
+		self.store = store
+		self.vaccinated = store.scratch(self.population, np.uint8)
+		self.vaccinated_friends = store.scratch(self.population, np.int32)
+
+		self.init_chunks()
 
-	def daily_step(self, num_infections):
+	def init_chunks(self):
+		'''
+		Set up the bounds the chunked daily step uses to skip chunks
+		without candidates.
+		'''
+
+		starts = range(0, self.population, self.chunk_size)
+		self.chunk_min_threshold = np.array(
+			[self.thresholds[start:start+self.chunk_size].min()
+			 for start in starts], dtype=float)
+		self.chunk_social_max = np.zeros(len(starts))
+
+	def daily_step(self, num_infections, max_vax=None):
 		'''
 		Run the agent-based model for one day.
 
@@ -178,11 +471,23 @@ class AgentBasedModel:
 		----------
 		num_infections : float
 			Number of infections that day.
+		max_vax : int, optional
+			Most vaccinations in this step, when it covers more or less than
+			a day. Default is max_daily_vax.
 		'''
 
+		max_vax = self.max_daily_vax if max_vax is None else max_vax
 		infection_influence = 1 - \
 		math.exp(-self.influence_param * (num_infections / self.population))
 
+		if self.engine == 'mmap' or \
+		(self.engine == 'array' and self.workers > 1):
+			self.chunked_step(infection_influence, max_vax)
+			return
+		if self.engine == 'array':
+			self.array_step(infection_influence, max_vax)
+			return
+
 		sample_list = []
 		unvaccinated = [x for x in self.agent_list if x.vaccinated==0]
 		
@@ -195,9 +500,9 @@ class AgentBasedModel:
 			if total_influence > agent.threshold:
 				sample_list.append(agent)
 
-		if len(sample_list) > self.max_daily_vax:
+		if len(sample_list) > max_vax:
 			vaccinated = self.vax_generator.choice(sample_list,
-												   size=self.max_daily_vax,
+												   size=max_vax,
 												   replace=False)
 		else:
 			vaccinated = sample_list
@@ -205,4 +510,234 @@ class AgentBasedModel:
 		for agent in vaccinated:
 			agent.vaccinated = 1
 
-		self.daily_vax = np.append(self.daily_vax, len(vaccinated))
\ No newline at end of file
+		self.vax_history.append(len(vaccinated))
+
+	def array_step(self, infection_influence, max_vax=None):
+		'''
+		Run the daily step of the array engine.
+
+		Social influence only changes for friends of newly vaccinated agents,
+		so a running count of vaccinated friends is updated for those agents
+		alone. Agents without vaccinated friends meet their threshold exactly
+		when it lies below the infection influence, which is a prefix of the
+		threshold-sorted index; only the frontier of agents with vaccinated
+		friends is tested individually. Candidates are kept in agent order, so
+		sampling with the same generator selects the same agents as the
+		object-based loop in daily_step.
+
+		Parameters
+		----------
+		infection_influence : float
+			Influence from the number of infections that day.
+		max_vax : int, optional
+			Most vaccinations in this step. Default is max_daily_vax.
+		'''
+
+		max_vax = self.max_daily_vax if max_vax is None else max_vax
+
+		# Agents with no vaccinated friends
+		cutoff = self.weight * infection_influence
+		k = np.searchsorted(self.sorted_thresholds, cutoff, side='left')
+		below = self.threshold_order[:k]
+		below = below[self.vaccinated[below] == 0]
+
+		# Agents with vaccinated friends
+		if self.abm_backend == 'numba':
+			above = kernels()['influence_candidates'](
+				self.frontier, self.thresholds, self.vaccinated,
+				self.vaccinated_friends, self.indptr, cutoff, 1-self.weight)
+		else:
+			with np.errstate(invalid='ignore'):
+				social_influence = self.vaccinated_friends[self.frontier] / \
+				self.degree[self.frontier]
+			total_influence = cutoff + (1-self.weight) * social_influence
+			above = self.frontier[total_influence >
+								  self.thresholds[self.frontier]]
+
+		sample_list = np.union1d(below, above)
+
+		if len(sample_list) > max_vax:
+			vaccinated = self.vax_generator.choice(sample_list,
+												   size=max_vax,
+												   replace=False)
+		else:
+			vaccinated = sample_list
+
+		self.vaccinated[vaccinated] = 1
+
+		# Update counts and the frontier for friends of new vaccinations
+		friends = csr_rows(self.indptr, self.indices, vaccinated)
+		friends, counts = np.unique(friends, return_counts=True)
+		self.vaccinated_friends[friends] += counts.astype(np.int32)
+		frontier = np.union1d(self.frontier, friends)
+		self.frontier = frontier[self.vaccinated[frontier] == 0]
+
+		self.vax_history.append(len(vaccinated))
+
+	def chunked_step(self, infection_influence, max_vax=None):
+		'''
+		Run the daily step in chunks of agents, on one or more threads.
+
+		Agents are scanned in chunks of chunk_size in index order, skipping
+		chunks whose lowest threshold is above the largest influence any of
+		their agents can receive. The chunks are split into contiguous
+		partitions, one per worker thread, which count their candidates
+		(NumPy releases the GIL while doing so). The counts are reduced in
+		partition order, the positions to vaccinate are sampled once among
+		all candidates, and they are gathered from the chunks holding them.
+		Sampling positions uses the same draws as sampling from the list of
+		candidates, so the agents vaccinated are the same whatever the
+		number of workers, and the same as with array_step given the same
+		thresholds, while memory use is bounded by the chunk size and the
+		cap.
+
+		Parameters
+		----------
+		infection_influence : float
+			Influence from the number of infections that day.
+		max_vax : int, optional
+			Most vaccinations in this step. Default is max_daily_vax.
+		'''
+
+		max_vax = self.max_daily_vax if max_vax is None else max_vax
+
+		# Chunks that may hold candidates
+		cutoff = self.weight * infection_influence
+		bounds = cutoff + (1-self.weight) * self.chunk_social_max
+		chunks = np.flatnonzero(self.chunk_min_threshold < bounds)
+
+		if self.workers > 1:
+			with ThreadPoolExecutor(self.workers) as executor:
+				vaccinated = self.select_candidates(chunks, cutoff, max_vax,
+													executor.map)
+		else:
+			vaccinated = self.select_candidates(chunks, cutoff, max_vax, map)
+
+		self.vaccinated[vaccinated] = 1
+
+		# Update counts and the bounds for friends of new vaccinations
+		friends = csr_rows(self.indptr, self.indices, vaccinated)
+		friends, counts = np.unique(friends, return_counts=True)
+		self.vaccinated_friends[friends] += counts.astype(np.int32)
+		social = self.vaccinated_friends[friends] / \
+		(self.indptr[friends + 1] - self.indptr[friends])
+		np.maximum.at(self.chunk_social_max, friends // self.chunk_size, social)
+
+		self.vax_history.append(len(vaccinated))
+
+	def select_candidates(self, chunks, cutoff, max_vax, mapper):
+		'''
+		Choose the agents vaccinated by the chunked daily step.
+
+		Parameters
+		----------
+		chunks : array_like, shape (m,)
+			Chunks that may hold candidates, in order.
+		cutoff : float
+			Weighted influence from the number of infections.
+		max_vax : int
+			Most vaccinations in this step.
+		mapper : callable
+			map, or the map method of an executor running the partitions.
+
+		Returns
+		-------
+		array_like, shape (n,)
+			Indices of the agents vaccinated.
+		'''
+
+		# Count candidates in each partition, in partition order
+		partitions = np.array_split(chunks, max(self.workers, 1))
+		scans = list(mapper(lambda partition:
+							self.scan_chunks(partition, cutoff, max_vax),
+							partitions))
+		counts = np.concatenate([scan[0] for scan in scans])
+		total = int(counts.sum())
+
+		if total <= max_vax:
+			vaccinated = [candidates for scan in scans for candidates in scan[1]]
+		else:
+			positions = self.vax_generator.choice(total, size=max_vax,
+												  replace=False)
+			offsets = np.cumsum(counts) - counts
+			owners = np.searchsorted(offsets, positions, side='right') - 1
+			vaccinated = list(mapper(lambda i:
+									 self.chunk_candidates(chunks[i], cutoff)
+									 [positions[owners == i] - offsets[i]],
+									 np.unique(owners)))
+
+		return np.concatenate(vaccinated) if vaccinated else \
+		np.zeros(0, dtype=np.int64)
+
+	def scan_chunks(self, chunks, cutoff, max_vax):
+		'''
+		Count the candidates in a partition of chunks.
+
+		Parameters
+		----------
+		chunks : array_like, shape (m,)
+			Chunks of the partition, in order.
+		cutoff : float
+			Weighted influence from the number of infections.
+		max_vax : int
+			Most vaccinations in this step.
+
+		Returns
+		-------
+		counts : array_like, shape (m,)
+			Number of candidates in each chunk.
+		kept : list of array_like
+			Candidates of the chunks, kept while the partition has no more
+			than max_vax of them.
+		'''
+
+		counts = np.zeros(len(chunks), dtype=np.int64)
+		kept = []
+		total = 0
+		for i, chunk in enumerate(chunks):
+			candidates = self.chunk_candidates(chunk, cutoff)
+			counts[i] = len(candidates)
+			total += len(candidates)
+			if total <= max_vax:
+				kept.append(candidates)
+
+		return counts, kept
+
+	def chunk_candidates(self, chunk, cutoff):
+		'''
+		Unvaccinated agents of a chunk whose influence exceeds their
+		threshold.
+
+		Parameters
+		----------
+		chunk : int
+			Index of the chunk.
+		cutoff : float
+			Weighted influence from the number of infections.
+
+		Returns
+		-------
+		array_like, shape (n,)
+			Indices of the candidates, in order.
+		'''
+
+		start = chunk * self.chunk_size
+		stop = min(start + self.chunk_size, self.population)
+
+		if self.abm_backend == 'numba':
+			return kernels()['influence_candidates'](
+				np.arange(start, stop), np.asarray(self.thresholds),
+				np.asarray(self.vaccinated), np.asarray(self.vaccinated_friends),
+				np.asarray(self.indptr), cutoff, 1-self.weight)
+
+		# Social influence, zero for agents without vaccinated friends
+		friends = self.vaccinated_friends[start:stop]
+		degree = np.diff(self.indptr[start:stop+1])
+		social_influence = np.zeros(stop - start)
+		np.divide(friends, degree, out=social_influence, where=friends > 0)
+
+		total_influence = cutoff + (1-self.weight) * social_influence
+		candidate = (total_influence > self.thresholds[start:stop]) & \
+		(self.vaccinated[start:stop] == 0)
+
+		return start + np.flatnonzero(candidate)
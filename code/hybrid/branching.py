@@ -0,0 +1,83 @@
+# Import required packages
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Snapshot the branches of a worker start from
+snapshot = None
+
+def set_snapshot(model):
+	'''
+	Give a worker process the snapshot to branch from.
+
+	Parameters
+	----------
+	model : HybridSim
+		Snapshot of a hybrid simulation.
+	'''
+
+	global snapshot
+	snapshot = model
+
+def run_branch(changes, function):
+	'''
+	Run one scenario branch from the snapshot of the worker.
+
+	Parameters
+	----------
+	changes : dict
+		Parameters changed in the branch (see HybridSim.set_parameters).
+	function : callable
+		Output of the branch, function(model), run once it is simulated.
+
+	Returns
+	-------
+	object
+		Output of the branch.
+	'''
+
+	branch = snapshot.fork(**changes)
+	branch.simulate()
+
+	return function(branch)
+
+def run_branches(model, branches, function, n_workers=None):
+	'''
+	Run scenario branches from the current day of a model in worker
+	processes.
+
+	Where processes can be forked, the workers inherit the model copy on
+	write, so nothing is pickled and pages are only copied as a branch
+	modifies them. Otherwise the model is sent to each worker once.
+
+	Parameters
+	----------
+	model : HybridSim
+		Model simulated up to the day the branches start.
+	branches : list of dict
+		Parameters changed in each branch (see HybridSim.set_parameters).
+	function : callable
+		Output of a branch, function(model), run once it is simulated. It
+		must be importable by name for the worker processes.
+	n_workers : int, optional
+		Number of worker processes. Default is the number of CPUs.
+
+	Returns
+	-------
+	list
+		Output of each branch.
+	'''
+
+	if 'fork' in multiprocessing.get_all_start_methods():
+		# Workers are forked on the first submit and inherit the snapshot
+		set_snapshot(model)
+		options = {'mp_context': multiprocessing.get_context('fork')}
+	else:
+		options = {'initializer': set_snapshot, 'initargs': (model,)}
+
+	try:
+		with ProcessPoolExecutor(n_workers, **options) as executor:
+			futures = [executor.submit(run_branch, changes, function)
+					   for changes in branches]
+			return [future.result() for future in futures]
+	finally:
+		set_snapshot(None)
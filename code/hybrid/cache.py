@@ -0,0 +1,40 @@
+# Import required packages
+from core.cache import ArrayCache
+
+class PopulationCache(ArrayCache):
+	'''
+	On-disk cache of generated populations and social networks.
+
+	Each entry is an ArrayCache entry holding the thresholds, the CSR
+	adjacency and the threshold-sorted index of a population, so
+	replications and worker processes on the same node share one read-only
+	copy through the page cache.
+	'''
+
+	# Bumped whenever the layout or the generated arrays change
+	version = 1
+
+	def get_or_create(self, key, create):
+		'''
+		Load the arrays for a key, generating and storing them if needed.
+
+		Parameters
+		----------
+		key : dict
+			JSON-serialisable settings that determine the population.
+		create : callable
+			Called without arguments to generate a dict of arrays on a miss.
+
+		Returns
+		-------
+		dict
+			Read-only memory-mapped arrays.
+		'''
+
+		arrays = self.load(key)
+		if arrays is None:
+			self.store(key, create())
+			arrays = self.load(key)
+			self.evict(keep=self.entry_name(key))
+
+		return arrays
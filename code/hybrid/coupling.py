@@ -0,0 +1,57 @@
+# Import required packages
+import copy
+import numpy as np
+from hybrid.hybrid import HybridSim
+
+def coupling_error(parameters, cache=None, model=None):
+	'''
+	Error of a coupling scheme against daily coupling.
+
+	The hybrid model is run with the coupling in the parameters and again
+	with fixed daily coupling, using the same seed, so the difference is
+	due to the coupling alone (up to the different draws when sampling
+	vaccinations).
+
+	Parameters
+	----------
+	parameters : dict
+		Parameters of the hybrid model (see HybridSim), with the coupling
+		options in the general parameters.
+	cache : PopulationCache, optional
+		Cache of generated populations, so both runs share one population.
+	model : HybridSim, optional
+		Model already simulated with these parameters and full dense output,
+		so only the daily run is needed. Default is to run it here.
+
+	Returns
+	-------
+	dict
+		steps and baseline_steps, the number of coupling steps of each run;
+		infections, the largest absolute difference in infections over the
+		whole days both runs cover; and the difference (coupled less daily)
+		in peak_infections, final_size and total_vaccinations.
+	'''
+
+	# Both runs keep the full dense output for comparison
+	coupled = copy.deepcopy(parameters)
+	coupled['system_dynamics']['dense_output'] = 'full'
+	daily = copy.deepcopy(coupled)
+	daily['general'].update(coupling='fixed', coupling_interval=1)
+
+	if model is None:
+		model = HybridSim(coupled, cache)
+		model.simulate()
+	elif model.dense_output != 'full':
+		raise ValueError('Model must keep the full dense output.')
+	baseline = HybridSim(daily, cache)
+	baseline.simulate()
+
+	days = np.arange(0, int(min(model.day, baseline.day)) + 1)
+	infections = model.interpolator(days)[1] - baseline.interpolator(days)[1]
+	error = {'steps': model.summary()['steps'],
+			 'baseline_steps': baseline.summary()['steps'],
+			 'infections': float(np.max(np.abs(infections)))}
+	for key in ['peak_infections', 'final_size', 'total_vaccinations']:
+		error[key] = model.summary()[key] - baseline.summary()[key]
+
+	return error
@@ -1,7 +1,9 @@
 # Import required packages/files
-import numpy as np
+import copy
+import math
 from hybrid.sd import SystemDynamics
-from hybrid.abm import Agent, AgentBasedModel
+from hybrid.abm import AgentBasedModel
+from hybrid.instrumentation import NullInstrumentation
 
 class HybridSim(AgentBasedModel, SystemDynamics):
 	'''
@@ -17,6 +19,33 @@ class HybridSim(AgentBasedModel, SystemDynamics):
 		Seed for reproducibility.
 	sd_model : SystemDynamics 
 		Object representing the system dynamics model.
+	day : int or float
+		Last day simulated (the time of the last coupling step).
+	coupling : str
+		Either 'fixed' (every coupling step lasts coupling_interval days) or
+		'adaptive' (the interval is doubled, up to max_coupling_interval,
+		while vaccinations are zero or at the cap and neither the vaccine
+		uptake nor the influence of infections changes by much). Default is
+		'fixed'.
+	coupling_interval : int or float
+		Days between exchanges of infections and vaccine uptake between the
+		models, and the shortest interval in adaptive mode. Default is 1.
+	max_coupling_interval : int or float
+		Longest interval in adaptive mode. Default is 7.
+	coupling_tolerance : float
+		Largest change over a step in vaccine uptake, as a fraction of the
+		largest uptake (max_daily_vax / population), and in the influence
+		of infections on agents, for which the interval is lengthened in
+		adaptive mode. Default is 0.0025.
+	coupling_steps : int
+		Current interval as a multiple of coupling_interval.
+	coupled_influence : float
+		Influence of infections on agents at the last coupling step.
+	stop_tolerance : float or None
+		If set, the simulation stops early once infections have peaked and
+		fallen below this number and no one was vaccinated that day.
+	stopped : bool
+		Whether the simulation stopped early.
 
 	Notes
 	-----
@@ -31,7 +60,8 @@ class HybridSim(AgentBasedModel, SystemDynamics):
 	pp. 240–256. doi: 10.1080/17477778.2021.1992312.
 	'''
 
-	def __init__(self, parameters):
+	def __init__(self, parameters, cache=None, instrumentation=None,
+				 observers=()):
 		'''
 		Initialise a hybrid simulation model. 
 
@@ -41,50 +71,325 @@ class HybridSim(AgentBasedModel, SystemDynamics):
 			Dictionary containing values for contact_rate, infectivity,
 			symptom_delay, quarantine_length, vaccine_fraction, 
 			quarantine_fraction, infectivity_length, population, max_daily_vax,
-			influence_param, beta_params, weight, horizon, main_seed.
+			influence_param, beta_params, weight, horizon, main_seed and
+			optionally stop_tolerance, coupling, coupling_interval,
+			max_coupling_interval and coupling_tolerance. Setting integrator
+			to 'persistent' in the system dynamics parameters keeps one solver
+			alive across days.
+		cache : PopulationCache, optional
+			Cache of generated populations shared between replications.
+		instrumentation : Instrumentation, optional
+			Records wall time per phase and solver statistics for each day
+			of simulate; see hybrid.instrumentation. Disabled by default.
+		observers : list of Sink, optional
+			Receive the outputs of each day as it is simulated; see
+			hybrid.observers. Combine with dense_output='window' in the
+			system dynamics parameters to run in bounded memory.
 		'''
 		
 		# Store additional params
 		self.horizon = parameters['general']['horizon']
 		self.main_seed = parameters['general']['main_seed']
+		self.stop_tolerance = parameters['general'].get('stop_tolerance', None)
+
+		# Interval between exchanges of the models
+		coupling = parameters['general'].get('coupling', 'fixed')
+		if coupling == 'fixed' or coupling == 'adaptive':
+			self.coupling = coupling
+		else:
+			raise ValueError('Coupling must either be fixed or adaptive.')
+		self.coupling_interval = parameters['general'].get('coupling_interval', 1)
+		if self.coupling_interval <= 0:
+			raise ValueError('Coupling interval must be positive.')
+		self.max_coupling_interval = \
+		parameters['general'].get('max_coupling_interval', 7)
+		self.coupling_tolerance = \
+		parameters['general'].get('coupling_tolerance', 0.0025)
+		self.coupling_steps = 1
+		self.coupled_influence = 0.0
 
 		# Inherit attributes / functions from sub-models
 		SystemDynamics.__init__(self, parameters['system_dynamics'])
 		AgentBasedModel.__init__(self, parameters['agent_based'], self.main_seed)
+		if instrumentation is not None:
+			self.instrumentation = instrumentation
+		self.observers = list(observers)
 
 		# Generate agents
-		self.generate_agents(int(self.population))
+		self.generate_agents(int(self.population), cache)
+
+		# Preallocate one row per coupling step
+		rows = math.ceil(self.horizon / self.coupling_interval) + 1
+		self.reserve_history(rows)
+		self.vax_history.reserve(rows)
+
+		# Last day simulated
+		self.day = 0
+		self.stopped = False
 
-	def simulate(self):
+	def simulate(self, until=None):
 		'''
-		Run the model until t=horizon.
+		Run the model from the last day simulated until t=until.
 
-		The order of logic each day is as follows:
+		The order of logic each coupling step (a day by default) is as
+		follows:
 			1) Solve the SD equations to obtain stock values.
-			2) Run the ABM and change agent states.
-			3) Calculate the proportion of vaccinations that day and update the
-			SD parameter.
+			2) Run the ABM and change agent states, allowing max_daily_vax
+			vaccinations per day of the step.
+			3) Calculate the proportion of vaccinations per day over the step
+			and update the SD parameter.
+
+		Observers and instrumentation see every coupling step, with day set
+		to its end time.
+
+		With stop_tolerance set, the run ends before until once the epidemic
+		has burned out (see burned_out); the outcomes are then those of the
+		last day simulated.
 
 		Parameters
 		----------
-		method : str
-			Method used by solve_ivp to solve stock equations. Default is 'RK45'.
-		rtol : float
-			Controls relative accuracy when using solve_ivp. Default is 1e-9.
+		until : int, optional
+			Last day to simulate. Default is the horizon.
 		'''
 
-		for t in range(1, self.horizon+1):
+		until = self.horizon if until is None else until
+
+		if self.day == 0:
+			for observer in self.observers:
+				observer.observe(0, self)
+
+		while self.day < until and not self.stopped:
+			self.instrumentation.start_day()
+			t = self.next_coupling(until)
 			
 			# Solve SD equations
 			self.solve(t)
 			
 			# Run one step of the ABM
-			self.daily_step(self.I[-1])
+			max_vax = self.vaccination_cap(self.day, t)
+			with self.instrumentation.phase('abm'):
+				self.daily_step(self.I[-1], max_vax)
 
 			# Update SD parameter
-			self.vaccine_uptake = self.daily_vax[-1] / self.population
+			uptake = self.daily_vax[-1] / (self.population * (t - self.day))
+			self.adapt_coupling(max_vax, uptake)
+			self.vaccine_uptake = uptake
+			self.instrumentation.end_day(t, self)
+
+			# Stream the outputs of the day
+			self.day = t
+			for observer in self.observers:
+				observer.observe(t, self)
+			self.stopped = self.burned_out()
 
 			# Print number of iterations completed
 			# if t % 10 == 0:
 			# 	print(f'Current timestep: {t}.')
-			# 	print(f'Simulation is {(t/self.horizon) * 100}% complete.')
\ No newline at end of file
+			# 	print(f'Simulation is {(t/self.horizon) * 100}% complete.')
+
+		if self.day == self.horizon or self.stopped:
+			for observer in self.observers:
+				observer.close()
+
+	def next_coupling(self, until):
+		'''
+		Time of the next coupling step.
+
+		Steps end on multiples of coupling_interval, so times do not drift
+		when the interval is a fraction of a day.
+
+		Parameters
+		----------
+		until : int or float
+			Last day to simulate.
+
+		Returns
+		-------
+		int or float
+			End of the step.
+		'''
+
+		k = round(self.day / self.coupling_interval)
+
+		return min((k + self.coupling_steps) * self.coupling_interval, until)
+
+	def vaccination_cap(self, start, end):
+		'''
+		Most vaccinations in a coupling step.
+
+		The cap is the number of whole multiples of max_daily_vax reached by
+		the end of the step less those reached by its start, so steps shorter
+		than a day share the daily cap without rounding losses.
+
+		Parameters
+		----------
+		start, end : int or float
+			Times the step starts and ends.
+
+		Returns
+		-------
+		int
+		'''
+
+		return math.floor(end * self.max_daily_vax + 1e-9) - \
+		math.floor(start * self.max_daily_vax + 1e-9)
+
+	def adapt_coupling(self, max_vax, uptake):
+		'''
+		Lengthen or reset the coupling interval in adaptive mode.
+
+		Parameters
+		----------
+		max_vax : int
+			Cap on vaccinations in the step just simulated.
+		uptake : float
+			Vaccine uptake over the step just simulated.
+		'''
+
+		if self.coupling != 'adaptive':
+			return
+
+		# Change in what each model passes to the other
+		influence = 1 - \
+		math.exp(-self.influence_param * self.I[-1] / self.population)
+		changes = [abs(uptake - self.vaccine_uptake) * self.population /
+				   self.max_daily_vax, abs(influence - self.coupled_influence)]
+		self.coupled_influence = influence
+
+		vaccinations = self.daily_vax[-1]
+		if (vaccinations == 0 or vaccinations == max_vax) and \
+		max(changes) <= self.coupling_tolerance:
+			longest = max(1, math.floor(self.max_coupling_interval /
+										self.coupling_interval + 1e-9))
+			self.coupling_steps = min(2 * self.coupling_steps, longest)
+		else:
+			self.coupling_steps = 1
+
+	def burned_out(self):
+		'''
+		Check the stopping rule.
+
+		Once infections are falling and no one was vaccinated on the last
+		day, the influence of infections only decreases and the social
+		influence stays the same, so no further agents are vaccinated and
+		the stocks just decay. Once infections are also below stop_tolerance,
+		the infections still to come are negligible and the outputs we
+		report no longer change.
+
+		Returns
+		-------
+		bool
+			Whether the simulation can stop.
+		'''
+
+		return self.stop_tolerance is not None and \
+		self.I[-1] < self.stop_tolerance and self.daily_vax[-1] == 0 and \
+		self.outcomes.growth < 0
+
+	def summary(self):
+		'''
+		Outcomes of the simulation so far, computed during the run.
+
+		Returns
+		-------
+		dict
+			peak_infections, peak_time, final_size, total_vaccinations, days
+			and steps (see hybrid.outcomes.Outcomes.summary).
+		'''
+
+		return self.outcomes.summary(self)
+
+	def set_parameters(self, **changes):
+		'''
+		Change parameters from the next day on, for example at the start of
+		an intervention.
+
+		Parameters
+		----------
+		**changes
+			New values of parameters, such as quarantine_fraction or
+			max_daily_vax, keyed by attribute name.
+		'''
+
+		for name, value in changes.items():
+			if name in ['method', 'delay_order', 'population', 'engine',
+						'chunk_size', 'workers', 'sd_backend', 'abm_backend'] or \
+			not hasattr(self, name):
+				raise ValueError(f'Parameter {name} cannot be changed.')
+			setattr(self, name, value)
+
+		# Keep derived rates in step and restart the persistent solver
+		if self.method == 'LCT':
+			self.a = self.delay_order / self.quarantine_length
+		if self.solver is not None:
+			self.solver_uptake = None
+
+	def snapshot(self):
+		'''
+		Copy the state of the model on the current day.
+
+		The copy includes the stocks and Erlang stages, the dense output
+		needed for the delay, the persistent solver, the agents' states and
+		the states of the random number generators, so simulating the copy
+		gives exactly the same results as continuing this model. Arrays
+		that are never modified (the population and network) and the solver
+		steps of the dense output are shared rather than copied, and the
+		vaccination state of the mmap engine is copied into new scratch
+		files of the same store. The copy has no instrumentation or
+		observers.
+
+		Returns
+		-------
+		HybridSim
+			Independent copy of the model.
+		'''
+
+		memo = {id(self.instrumentation): NullInstrumentation(),
+				id(self.observers): []}
+		for name in ['thresholds', 'indptr', 'indices', 'threshold_order',
+					 'sorted_thresholds']:
+			if hasattr(self, name):
+				memo[id(getattr(self, name))] = getattr(self, name)
+		if self.interpolator is not None:
+			for interpolant in self.interpolator.interpolants:
+				memo[id(interpolant)] = interpolant
+
+		# Scratch files of the mmap engine are copied into new ones, so the
+		# copy stays out of core and does not write to this model's files
+		if self.engine == 'mmap':
+			memo[id(self.store)] = self.store
+			for name in ['vaccinated', 'vaccinated_friends']:
+				array = getattr(self, name)
+				memo[id(array)] = self.store.scratch(array.shape, array.dtype)
+				memo[id(array)][...] = array
+
+		# Agents of the object engine refer to each other through their
+		# friends, so they are copied up front rather than recursively
+		if self.engine == 'object':
+			for agent in self.agent_list:
+				memo[id(agent)] = copy.copy(agent)
+			for agent in self.agent_list:
+				memo[id(agent)].friends = [memo[id(friend)]
+										   for friend in agent.friends]
+
+		return copy.deepcopy(self, memo)
+
+	def fork(self, **changes):
+		'''
+		Start a scenario branch from the current day.
+
+		Parameters
+		----------
+		**changes
+			Parameters changed in the branch (see set_parameters).
+
+		Returns
+		-------
+		HybridSim
+			Snapshot of the model with the changes applied.
+		'''
+
+		branch = self.snapshot()
+		branch.set_parameters(**changes)
+
+		return branch
\ No newline at end of file
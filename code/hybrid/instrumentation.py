@@ -0,0 +1,227 @@
+# Import required packages
+import time
+import numpy as np
+from contextlib import nullcontext
+
+class NullInstrumentation:
+	'''
+	Instrumentation that records nothing, used by default.
+
+	Every hook is an empty method and phase returns one shared null
+	context, so the cost when instrumentation is disabled is a few method
+	calls per day.
+	'''
+
+	# Shared context returned by phase
+	context = nullcontext()
+
+	def start_day(self):
+		'''
+		Mark the start of a day.
+		'''
+
+	def phase(self, name):
+		'''
+		Context timing one phase of the current day.
+
+		Parameters
+		----------
+		name : str
+			Name of the phase.
+
+		Returns
+		-------
+		context manager
+		'''
+
+		return self.context
+
+	def solver(self, nfev, njev, nlu):
+		'''
+		Add solver statistics to the current day.
+
+		Parameters
+		----------
+		nfev, njev, nlu : int
+			Right-hand side evaluations, Jacobian evaluations and LU
+			factorisations.
+		'''
+
+	def end_day(self, day, model):
+		'''
+		Mark the end of a day.
+
+		Parameters
+		----------
+		day : int
+			Day just simulated.
+		model : HybridSim
+			Model being simulated.
+		'''
+
+class Phase:
+	'''
+	Context adding its wall time to a phase of the current day.
+	'''
+
+	def __init__(self, record, name):
+		'''
+		Initialise a phase.
+
+		Parameters
+		----------
+		record : dict
+			Record of the current day.
+		name : str
+			Name of the phase.
+		'''
+
+		self.record = record
+		self.name = name
+
+	def __enter__(self):
+		'''
+		Start timing the phase.
+		'''
+
+		self.start = time.perf_counter()
+
+	def __exit__(self, *args):
+		'''
+		Add the time since the phase started to the record.
+		'''
+
+		phases = self.record['phases']
+		phases[self.name] = phases.get(self.name, 0.0) + \
+		time.perf_counter() - self.start
+
+class Instrumentation(NullInstrumentation):
+	'''
+	Records wall time per phase and solver statistics for each day of a
+	hybrid simulation.
+
+	Phases are 'solve' (integrating the stock equations), 'interpolator'
+	(extending the dense output and reading the stocks back), 'outcomes'
+	(tracking the peak of infections) and 'abm' (the daily step of the
+	agent-based model); time not spent in any phase is reported as
+	'other'. nfev counts every evaluation of the right-hand side, all of
+	which are made by the solver (the peak of infections is located on the
+	dense output, without evaluating it).
+
+	Attributes
+	----------
+	records : list of dict
+		Record of every day completed.
+	hook : callable or None
+		Called as hook(day, record) at the end of each day.
+	'''
+
+	def __init__(self, hook=None):
+		'''
+		Initialise instrumentation.
+
+		Parameters
+		----------
+		hook : callable, optional
+			Called as hook(day, record) at the end of each day, for example
+			to log progress.
+		'''
+
+		self.hook = hook
+		self.records = []
+		self.record = None
+
+	def start_day(self):
+		'''
+		Mark the start of a day.
+		'''
+
+		self.start = time.perf_counter()
+		self.record = {'phases': {}, 'nfev': 0, 'njev': 0, 'nlu': 0}
+
+	def phase(self, name):
+		'''
+		Context timing one phase of the current day.
+
+		Parameters
+		----------
+		name : str
+			Name of the phase.
+
+		Returns
+		-------
+		Phase
+		'''
+
+		return Phase(self.record, name)
+
+	def solver(self, nfev, njev, nlu):
+		'''
+		Add solver statistics to the current day.
+
+		Parameters
+		----------
+		nfev, njev, nlu : int
+			Right-hand side evaluations, Jacobian evaluations and LU
+			factorisations.
+		'''
+
+		self.record['nfev'] += int(nfev)
+		self.record['njev'] += int(njev)
+		self.record['nlu'] += int(nlu)
+
+	def end_day(self, day, model):
+		'''
+		Mark the end of a day, recording its wall time and the size of the
+		interpolator.
+
+		Parameters
+		----------
+		day : int
+			Day just simulated.
+		model : HybridSim
+			Model being simulated.
+		'''
+
+		record = self.record
+		record['day'] = day
+		record['wall'] = time.perf_counter() - self.start
+		record['phases']['other'] = record['wall'] - \
+		sum(record['phases'].values())
+		record['segments'] = model.interpolator.n_segments
+		self.records.append(record)
+
+		if self.hook is not None:
+			self.hook(day, record)
+
+	def report(self):
+		'''
+		Structured report of the days recorded.
+
+		Returns
+		-------
+		dict
+			Arrays over days of day, wall, every phase (under 'phases'),
+			nfev, njev, nlu and segments, with totals of the times and
+			solver statistics and the final number of segments under
+			'totals'.
+		'''
+
+		names = []
+		for record in self.records:
+			names += [name for name in record['phases'] if name not in names]
+
+		report = {key: np.array([record[key] for record in self.records])
+				  for key in ['day', 'wall', 'nfev', 'njev', 'nlu', 'segments']}
+		report['phases'] = {name: np.array([record['phases'].get(name, 0.0)
+											for record in self.records])
+							for name in names}
+
+		totals = {key: report[key].sum() for key in ['wall', 'nfev', 'njev',
+													 'nlu']}
+		totals.update({name: times.sum()
+					   for name, times in report['phases'].items()})
+		totals['segments'] = report['segments'][-1] if self.records else 0
+		report['totals'] = totals
+
+		return report
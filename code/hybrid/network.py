@@ -0,0 +1,274 @@
+# Import required packages
+import numpy as np
+
+# Rows of the ring lattice filled at a time
+CHUNK_SIZE = 2**20
+
+def newman_watts_strogatz(population, k, p, seed=None, allocate=None):
+	'''
+	Generate a Newman-Watts-Strogatz small-world network as CSR arrays.
+
+	Each node is joined to its k // 2 nearest neighbours on either side of
+	a ring. Then, for every ring edge (u, u + j), with probability p a
+	shortcut is added from u to a node drawn uniformly at random. Shortcuts
+	that would create a self-loop or a duplicate edge are redrawn. This is
+	the topology produced by networkx.newman_watts_strogatz_graph [1], but
+	it is written straight into integer arrays, so memory stays at a few
+	bytes per edge. The arrays can be allocated by the caller, for example
+	as memory-mapped files, in which case only the shortcuts are held in
+	memory.
+
+	Parameters
+	----------
+	population : int
+		Number of nodes.
+	k : int
+		Each node is joined with its k nearest neighbours in the ring.
+	p : float
+		Probability of adding a shortcut for each ring edge.
+	seed : int, SeedSequence or Generator, optional
+		Seed for reproducibility.
+	allocate : callable, optional
+		Called as allocate(name, shape, dtype) for 'indptr' and 'indices' to
+		return the array each is written into. Default allocates in memory.
+
+	Returns
+	-------
+	indptr : array_like, shape (population+1,)
+		Row pointers; the friends of node i are indices[indptr[i]:indptr[i+1]].
+	indices : array_like, shape (2*edges,)
+		Column indices, stored as int32 where the population allows.
+
+	References
+	----------
+	.. [1] Newman M E J, Watts D J (1999) Renormalization group analysis
+	of the small-world network model. Physics Letters A 263(4-6) pp.341-
+	346. https://doi.org/10.1016/S0375-9601(99)00757-4.
+	'''
+
+	if k > population:
+		raise ValueError('k must not be larger than the population.')
+	if not 0 <= p <= 1:
+		raise ValueError('p must be between 0 and 1.')
+
+	if allocate is None:
+		allocate = lambda name, shape, dtype: np.empty(shape, dtype=dtype)
+
+	rng = np.random.default_rng(seed)
+	n = int(population)
+	half = k // 2
+	dtype = np.int32 if n < 2**31 else np.int64
+
+	# Number of shortcuts attempted from each node
+	sources = []
+	for start in range(0, n, CHUNK_SIZE):
+		stop = min(start + CHUNK_SIZE, n)
+		attempts = rng.binomial(half, p, size=stop-start)
+		sources.append(np.repeat(np.arange(start, stop, dtype=np.int64),
+								 attempts))
+	sources = np.concatenate(sources) if sources else np.zeros(0, np.int64)
+
+	# Draw shortcut targets, redrawing self-loops and duplicate edges
+	targets = rng.integers(0, n, size=len(sources), dtype=np.int64)
+	redraw = invalid_shortcuts(sources, targets, n, half)
+	rounds = 0
+	while redraw.any():
+		rounds += 1
+		if rounds > 100:
+			# Nodes linked to everyone else cannot take a shortcut
+			sources = sources[~redraw]
+			targets = targets[~redraw]
+			break
+		targets[redraw] = rng.integers(0, n, size=int(redraw.sum()),
+									   dtype=np.int64)
+		redraw = invalid_shortcuts(sources, targets, n, half)
+
+	# Shortcuts in both directions, grouped by row
+	rows = np.concatenate((sources, targets))
+	cols = np.concatenate((targets, sources))
+	order = np.argsort(rows, kind='stable')
+	rows = rows[order]
+	cols = cols[order]
+
+	# Row pointers: 2 * half ring neighbours plus shortcuts, filled in chunks
+	# of rows
+	indptr = allocate('indptr', (n + 1,), np.int64)
+	for start in range(0, n + 1, CHUNK_SIZE):
+		stop = min(start + CHUNK_SIZE, n + 1)
+		nodes = np.arange(start, stop, dtype=np.int64)
+		indptr[start:stop] = 2 * half * nodes + \
+		np.searchsorted(rows, nodes, side='left')
+	indices = allocate('indices', (int(indptr[-1]),), dtype)
+
+	# Ring lattice neighbours, filled in chunks of rows
+	offsets = np.concatenate((np.arange(-half, 0), np.arange(1, half + 1)))
+	for start in range(0, n, CHUNK_SIZE):
+		stop = min(start + CHUNK_SIZE, n)
+		nodes = np.arange(start, stop, dtype=np.int64)
+		positions = indptr[start:stop, None] + np.arange(2 * half)
+		indices[positions] = (nodes[:, None] + offsets) % n
+
+	# Shortcuts follow the ring neighbours within each row
+	rank = np.arange(len(rows)) - np.searchsorted(rows, rows, side='left')
+	indices[indptr[rows] + 2 * half + rank] = cols
+
+	return indptr, indices
+
+def invalid_shortcuts(sources, targets, population, half):
+	'''
+	Flag shortcuts that are self-loops or duplicate an existing edge.
+
+	Parameters
+	----------
+	sources : array_like, shape (m,)
+		Nodes the shortcuts start from.
+	targets : array_like, shape (m,)
+		Nodes the shortcuts end at.
+	population : int
+		Number of nodes.
+	half : int
+		Number of ring neighbours on either side of a node.
+
+	Returns
+	-------
+	array_like, shape (m,)
+		True where a shortcut must be redrawn. Of several identical
+		shortcuts the first is kept.
+	'''
+
+	# Self-loops and ring edges
+	distance = np.abs(sources - targets)
+	distance = np.minimum(distance, population - distance)
+	invalid = distance <= half
+
+	# Repeated shortcuts, in either direction
+	keys = np.minimum(sources, targets) * population + \
+	np.maximum(sources, targets)
+	keys[invalid] = -1 - np.arange(int(invalid.sum()))
+	order = np.argsort(keys, kind='stable')
+	repeated = np.zeros(len(keys), dtype=bool)
+	repeated[order[1:]] = keys[order[1:]] == keys[order[:-1]]
+
+	return invalid | repeated
+
+def networkx_newman_watts_strogatz(population, k, p, seed=None):
+	'''
+	Generate a Newman-Watts-Strogatz network with networkx as CSR arrays.
+
+	Reproduces the networks of earlier versions of the model, which were
+	built with networkx.newman_watts_strogatz_graph.
+
+	Parameters
+	----------
+	population : int
+		Number of nodes.
+	k : int
+		Each node is joined with its k nearest neighbours in the ring.
+	p : float
+		Probability of adding a shortcut for each ring edge.
+	seed : int or Generator, optional
+		Seed for reproducibility.
+
+	Returns
+	-------
+	indptr : array_like, shape (population+1,)
+		CSR row pointers.
+	indices : array_like, shape (2*edges,)
+		CSR column indices.
+	'''
+
+	import networkx as nx
+
+	graph = nx.newman_watts_strogatz_graph(population, k, p, seed=seed)
+
+	return graph_to_csr(graph, population)
+
+def to_networkx(indptr, indices):
+	'''
+	Export a CSR network as a networkx graph with nodes 0, ..., n-1.
+
+	Parameters
+	----------
+	indptr : array_like, shape (n+1,)
+		CSR row pointers.
+	indices : array_like, shape (2*edges,)
+		CSR column indices.
+
+	Returns
+	-------
+	Graph object
+		Undirected networkx graph.
+	'''
+
+	import networkx as nx
+
+	population = len(indptr) - 1
+	rows = np.repeat(np.arange(population), np.diff(indptr))
+	graph = nx.Graph()
+	graph.add_nodes_from(range(population))
+	graph.add_edges_from(zip(rows.tolist(), np.asarray(indices).tolist()))
+
+	return graph
+
+def csr_rows(indptr, indices, rows):
+	'''
+	Gather the concatenated column indices of a set of CSR rows.
+
+	Parameters
+	----------
+	indptr : array_like, shape (n+1,)
+		CSR row pointers.
+	indices : array_like, shape (m,)
+		CSR column indices.
+	rows : array_like, shape (k,)
+		Rows to gather.
+
+	Returns
+	-------
+	array_like, shape (l,)
+		Column indices of the given rows, in row order.
+	'''
+
+	rows = np.asarray(rows, dtype=np.int64)
+	starts = indptr[rows]
+	lengths = indptr[rows + 1] - starts
+	total = int(lengths.sum())
+	if total == 0:
+		return np.zeros(0, dtype=indices.dtype)
+
+	# Position of every gathered entry within the indices array
+	offsets = np.cumsum(lengths) - lengths
+	positions = np.arange(total, dtype=np.int64) - np.repeat(offsets, lengths)
+	positions += np.repeat(starts, lengths)
+
+	return indices[positions]
+
+def graph_to_csr(graph, population):
+	'''
+	Convert a graph with nodes 0, ..., population-1 into CSR arrays.
+
+	Parameters
+	----------
+	graph : Graph object
+		Undirected networkx graph.
+	population : int
+		Number of nodes.
+
+	Returns
+	-------
+	indptr : array_like, shape (population+1,)
+		Row pointers; the friends of agent i are indices[indptr[i]:indptr[i+1]].
+	indices : array_like, shape (2*edges,)
+		Column indices.
+	'''
+
+	edges = np.array(graph.edges(), dtype=np.int64).reshape((-1, 2))
+	rows = np.concatenate((edges[:,0], edges[:,1]))
+	cols = np.concatenate((edges[:,1], edges[:,0]))
+
+	order = np.argsort(rows, kind='stable')
+	indices = cols[order]
+	indptr = np.zeros(population + 1, dtype=np.int64)
+	np.cumsum(np.bincount(rows, minlength=population), out=indptr[1:])
+
+	return indptr, indices
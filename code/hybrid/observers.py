@@ -0,0 +1,210 @@
+# Import required packages
+import abc
+import glob
+import os
+import numpy as np
+from core.history import History
+
+# Outputs that can be streamed, recorded at the end of each day
+FIELDS = ['day', 'S', 'I', 'Q', 'R', 'daily_vax', 'vaccinated_fraction']
+
+class Sink(abc.ABC):
+	'''
+	Observer of a hybrid simulation that streams selected outputs.
+
+	HybridSim calls observe at day 0 and at the end of every day (every
+	coupling step, if the coupling interval is not a day), then close once
+	the simulation is complete. Subclasses store each row by
+	implementing write, and cannot be created without it.
+
+	Attributes
+	----------
+	fields : list of str
+		Outputs recorded, from FIELDS.
+	vaccinated : int
+		Total vaccinations so far.
+	'''
+
+	def __init__(self, fields=None):
+		'''
+		Initialise a sink.
+
+		Parameters
+		----------
+		fields : list of str, optional
+			Outputs recorded, from FIELDS. Default is all of them.
+		'''
+
+		self.fields = list(FIELDS) if fields is None else list(fields)
+		unknown = set(self.fields) - set(FIELDS)
+		if unknown:
+			raise ValueError(f'Unknown fields {sorted(unknown)}.')
+		self.vaccinated = 0
+
+	def observe(self, day, model):
+		'''
+		Record the outputs of a day.
+
+		Parameters
+		----------
+		day : int
+			Day just simulated (0 for the initial state).
+		model : HybridSim
+			Model being simulated.
+		'''
+
+		daily_vax = model.daily_vax[-1]
+		self.vaccinated += daily_vax
+		values = {'day': day, 'S': model.S[-1], 'I': model.I[-1],
+				  'Q': model.Q[-1], 'R': model.R[-1], 'daily_vax': daily_vax,
+				  'vaccinated_fraction': self.vaccinated / model.population}
+		self.write([values[field] for field in self.fields])
+
+	@abc.abstractmethod
+	def write(self, row):
+		'''
+		Store one row of outputs, in the order of fields.
+		'''
+
+	def close(self):
+		'''
+		Finish recording.
+		'''
+
+class MemorySink(Sink):
+	'''
+	Sink keeping the outputs in memory.
+	'''
+
+	def __init__(self, fields=None):
+		'''
+		Initialise an in-memory sink.
+
+		Parameters
+		----------
+		fields : list of str, optional
+			Outputs recorded, from FIELDS. Default is all of them.
+		'''
+
+		super().__init__(fields)
+		self.rows = None
+
+	def write(self, row):
+		'''
+		Store one row of outputs, in the order of fields.
+		'''
+
+		if self.rows is None:
+			self.rows = History(row)
+		else:
+			self.rows.append(row)
+
+	def results(self):
+		'''
+		Outputs recorded so far.
+
+		Returns
+		-------
+		dict
+			Array of every field over the days observed.
+		'''
+
+		rows = self.rows.view if self.rows is not None else \
+		np.empty((0, len(self.fields)))
+
+		return {field: rows[:, i] for i, field in enumerate(self.fields)}
+
+class ChunkedFileSink(Sink):
+	'''
+	Sink writing the outputs to a folder of columnar chunk files.
+
+	Rows are buffered and written every chunk_size days as
+	chunk-NNNNN.npz, holding one array per field, so memory use does not
+	grow with the horizon. Read the folder back with load_chunks.
+
+	Attributes
+	----------
+	directory : str
+		Folder holding the chunks.
+	chunk_size : int
+		Number of days in each chunk.
+	'''
+
+	def __init__(self, directory, fields=None, chunk_size=1000):
+		'''
+		Initialise a chunked file sink.
+
+		Parameters
+		----------
+		directory : str
+			Folder holding the chunks. Created if needed; chunks already
+			there are removed.
+		fields : list of str, optional
+			Outputs recorded, from FIELDS. Default is all of them.
+		chunk_size : int, optional
+			Number of days in each chunk. Default is 1000.
+		'''
+
+		super().__init__(fields)
+		self.directory = directory
+		self.chunk_size = chunk_size
+		os.makedirs(self.directory, exist_ok=True)
+		for path in glob.glob(os.path.join(self.directory, 'chunk-*.npz')):
+			os.remove(path)
+
+		self.buffer = np.empty((chunk_size, len(self.fields)))
+		self.size = 0
+		self.chunks = 0
+
+	def write(self, row):
+		'''
+		Buffer one row of outputs, writing a chunk when the buffer is full.
+		'''
+
+		self.buffer[self.size] = row
+		self.size += 1
+		if self.size == self.chunk_size:
+			self.flush()
+
+	def flush(self):
+		'''
+		Write the buffered rows as a chunk.
+		'''
+
+		if self.size == 0:
+			return
+		path = os.path.join(self.directory, f'chunk-{self.chunks:05d}.npz')
+		np.savez(path, **{field: self.buffer[:self.size, i]
+						  for i, field in enumerate(self.fields)})
+		self.chunks += 1
+		self.size = 0
+
+	def close(self):
+		'''
+		Write any remaining rows.
+		'''
+
+		self.flush()
+
+def load_chunks(directory):
+	'''
+	Read the outputs written by a ChunkedFileSink.
+
+	Parameters
+	----------
+	directory : str
+		Folder holding the chunks.
+
+	Returns
+	-------
+	dict
+		Array of every field over the days recorded.
+	'''
+
+	columns = {}
+	for path in sorted(glob.glob(os.path.join(directory, 'chunk-*.npz'))):
+		with np.load(path) as chunk:
+			for field in chunk.files:
+				columns.setdefault(field, []).append(chunk[field])
+
+	return {field: np.concatenate(arrays) for field, arrays in columns.items()}
@@ -0,0 +1,112 @@
+# Import required packages
+import numpy as np
+from numpy.polynomial.polynomial import polyval
+from scipy.optimize import brentq
+
+class Outcomes:
+	'''
+	Summary outcomes of a run, updated online as the stock equations are
+	solved.
+
+	The peak of infections is found on the dense output itself. Each LSODA
+	step is interpolated by a polynomial (in Nordsieck form), so the value
+	and the rate of change of I within the step are read from its
+	coefficients, without evaluating the stock equations. When the rate
+	of change goes from positive to negative across a step, the time of
+	the peak is located within the step with Brent's method on the
+	derivative of the polynomial. This gives the largest value of the
+	interpolated I rather than the largest value on a grid, and works with
+	both integrators.
+
+	Attributes
+	----------
+	peak_infections : float
+		Largest number of infections so far.
+	peak_time : float
+		Time of the largest number of infections.
+	growth : float or None
+		Rate of change of I at the end of the last step.
+	'''
+
+	def __init__(self):
+		'''
+		Initialise the outcomes.
+		'''
+
+		self.peak_infections = -np.inf
+		self.peak_time = None
+		self.growth = None
+
+	def update(self, ts, interpolants):
+		'''
+		Update the outcomes with new solver steps.
+
+		Parameters
+		----------
+		ts : array_like, shape (m+1,)
+			Boundaries of the solver steps.
+		interpolants : list of LsodaDenseOutput
+			Dense output of every step.
+		'''
+
+		for t0, interpolant in zip(ts[:-1], interpolants):
+			# I as a polynomial in x = (t - t1) / h, where the step ends at
+			# t1 = interpolant.t (x = 0) and starts at x0
+			coefficients = interpolant.yh[1]
+			x0 = (t0 - interpolant.t) / interpolant.h
+			if self.peak_time is None:
+				self.record(t0, polyval(x0, coefficients))
+
+			# Peak within the step, where the rate of change of I goes from
+			# positive at the start to negative at the end
+			self.growth = coefficients[1] / interpolant.h
+			if self.growth < 0:
+				slopes = coefficients[1:] * interpolant.p[1:]
+				if polyval(x0, slopes) > 0:
+					x = brentq(lambda x: polyval(x, slopes), x0, 0)
+					self.record(interpolant.t + x * interpolant.h,
+								polyval(x, coefficients))
+			self.record(interpolant.t, coefficients[0])
+
+	def record(self, t, infections):
+		'''
+		Keep a candidate for the peak if it is the largest so far.
+
+		Parameters
+		----------
+		t : float
+			Time of the candidate.
+		infections : float
+			Number of infections at time t.
+		'''
+
+		if infections > self.peak_infections:
+			self.peak_infections = infections
+			self.peak_time = t
+
+	def summary(self, model):
+		'''
+		Outcomes of a hybrid simulation.
+
+		Parameters
+		----------
+		model : HybridSim
+			Model simulated.
+
+		Returns
+		-------
+		dict
+			peak_infections and peak_time; final_size, the number of people
+			who have left the susceptible stock (by infection or
+			vaccination); total_vaccinations from the agent-based model;
+			days, the last day simulated; and steps, the number of coupling
+			steps.
+		'''
+
+		return {'peak_infections': float(self.peak_infections),
+				'peak_time': None if self.peak_time is None else
+				float(self.peak_time),
+				'final_size': float(model.population - model.S[-1]),
+				'total_vaccinations': int(np.sum(model.daily_vax)),
+				'days': model.day,
+				'steps': len(model.daily_vax) - 1}
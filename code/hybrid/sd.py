@@ -1,52 +1,15 @@
 # Import required packages
 import numpy as np
-from scipy.integrate import solve_ivp, OdeSolution
-
-class Interpolator(OdeSolution):
-	'''
-	Object for interpolation of stock values.
-
-	Attributes
-	----------
-	interpolator : OdeSolution
-		Object containing functions for interpolation. 
-	'''
-
-	def __init__(self, ts, interpolants, bounds):
-		'''
-		Initialise an interpolator for the model. 
-		'''
-
-		super().__init__(ts, interpolants)
-
-		# Stock bounds
-		self.lower, self.upper = bounds
-
-	def __call__(self, t):
-		'''
-		Return interpolated value(s) at a singular or array of time points.
-		Adjust the value in line with bounds (to account for error).
-
-		Parameters
-		----------
-		t : float or array_like, shape (n,)
-			Singular or array of time points to solve at.
-		adjust : bool
-			Adjusts stock values so bounds are not violated if True. 
-
-		Returns
-		-------
-		array_like, shape (n,)
-			Interpolated values. 
-		'''
-
-		# Use __call__ to return interpolated stock values
-		vals = super().__call__(t)
-		# Adjust in line with boundaries if specified
-		vals[(vals < self.lower)] = self.lower
-		vals[(vals > self.upper)] = self.upper
-
-		return vals
+from scipy.integrate import solve_ivp
+from core.history import History
+from core.dense import DenseSolution
+from core.delay import DelayHistory
+from core.erlang import (erlang_chain, siqr_jacobian, lct_banded_jacobian,
+						 LOWER_BAND, UPPER_BAND)
+from core.kernels import resolve_backend, kernels
+from core.integrator import PersistentLSODA
+from hybrid.instrumentation import NullInstrumentation
+from hybrid.outcomes import Outcomes
 
 class SystemDynamics:
 	'''
@@ -78,6 +41,34 @@ class SystemDynamics:
 		Number of recovered individuals at each time point in time.
 	time : array_like, shape (n,)
 		Time points at which the equations have been solved.
+	stock_history : History
+		Stock values (S, I, Q, R) at each time point, read through S, I, Q
+		and R.
+	stage_history : History
+		Intermediate stocks of the LCT approach at each time point, read
+		through Z.
+	time_history : History
+		Time points, read through time.
+	integrator : str
+		Either 'restart' (a new solve_ivp call for every solve) or
+		'persistent' (one LSODA solver advanced across solves). Default is
+		'restart'.
+	solver : PersistentLSODA
+		Live solver for the persistent integrator.
+	dense_output : str
+		Either 'full' (the interpolator covers the whole run) or 'window'
+		(older solver steps are dropped, keeping only those still needed
+		for lagged lookups, so memory does not grow with the horizon).
+		Default is 'full'.
+	sd_backend : str
+		Either 'numpy' (the default) or 'numba', which evaluates the stock
+		equations with a compiled kernel.
+	instrumentation : NullInstrumentation
+		Receives phase times and solver statistics (see
+		hybrid.instrumentation).
+	outcomes : Outcomes
+		Peak infections, updated on every solver step (see
+		hybrid.outcomes).
 
 	Notes
 	-----
@@ -100,7 +91,9 @@ class SystemDynamics:
 		parameters : dict
 			Dictionary containing values for contact_rate, infectivity,
 			symptom_delay, quarantine_length, vaccine_uptake, 
-			quarantine_fraction, infectivity_length, population.
+			quarantine_fraction, infectivity_length, population and
+			optionally integrator, dense_output and backend ('numpy', 'numba'
+			or 'auto'; see core.kernels.resolve_backend).
 		initial_conditions : dict, optional
 			Dicitionary containing initial stock values for susceptible,
 			infected, quarantined and recovered individuals.
@@ -112,6 +105,23 @@ class SystemDynamics:
 		else: 
 			raise ValueError('Method must either be LCT or interp.')
 
+		# Integrator used across calls to solve
+		integrator = parameters.get('integrator', 'restart')
+		if integrator == 'restart' or integrator == 'persistent':
+			self.integrator = integrator
+		else:
+			raise ValueError('Integrator must either be restart or persistent.')
+
+		# Dense output kept for the whole run or for the lag window only
+		dense_output = parameters.get('dense_output', 'full')
+		if dense_output == 'full' or dense_output == 'window':
+			self.dense_output = dense_output
+		else:
+			raise ValueError('Dense output must either be full or window.')
+
+		# Backend evaluating the stock equations
+		self.sd_backend = resolve_backend(parameters.get('backend', 'numpy'))
+
 		# Parameters
 		self.contact_rate = parameters['contact_rate']
 		self.infectivity = parameters['infectivity']
@@ -124,31 +134,100 @@ class SystemDynamics:
 
 		# Initial_conditions
 		if initial_conditions:
-			self.S = np.array([initial_conditions['susceptible']])
-			self.I = np.array([initial_conditions['infected']])
-			self.Q = np.array([initial_conditions['quarantined']])
-			self.R = np.array([initial_conditions['recovered']])
+			self.stock_history = History([initial_conditions['susceptible'],
+										  initial_conditions['infected'],
+										  initial_conditions['quarantined'],
+										  initial_conditions['recovered']])
 		else:
-			self.S = np.array([self.population - 1])
-			self.I = np.array([1])
-			self.Q = np.array([0])
-			self.R = np.array([0])
+			self.stock_history = History([self.population - 1, 1, 0, 0])
 
 		# Intermediate stocks for LCT approach
 		if self.method == 'LCT':
 			self.delay_order = parameters['delay_order']
 			self.a = self.delay_order / self.quarantine_length
-			self.Z = np.zeros(self.delay_order)
-			self.Z = self.Z.reshape((1,self.delay_order))
+			self.stage_history = History(np.zeros(self.delay_order))
 			if isinstance(self.delay_order, int) == False:
 				raise ValueError('Order must be an integer.')
 
 		# Store timepoints
-		self.time = np.array([0])
+		self.time_history = History(0)
 
 		# Interpolator class
 		self.interpolator = None
+		self.delayed_infections = None
+
+		# Live solver for the persistent integrator
+		self.solver = None
+
+		# Instrumentation, disabled unless replaced
+		self.instrumentation = NullInstrumentation()
+
+		# Outcomes tracked while solving
+		self.outcomes = Outcomes()
 		
+	@property
+	def S(self):
+		'''
+		Number of susceptible individuals at each time point.
+		'''
+
+		return self.stock_history.view[:,0]
+
+	@property
+	def I(self):
+		'''
+		Number of infected individuals at each time point.
+		'''
+
+		return self.stock_history.view[:,1]
+
+	@property
+	def Q(self):
+		'''
+		Number of quarantined individuals at each time point.
+		'''
+
+		return self.stock_history.view[:,2]
+
+	@property
+	def R(self):
+		'''
+		Number of recovered individuals at each time point.
+		'''
+
+		return self.stock_history.view[:,3]
+
+	@property
+	def Z(self):
+		'''
+		Intermediate stocks of the LCT approach at each time point.
+		'''
+
+		return self.stage_history.view
+
+	@property
+	def time(self):
+		'''
+		Time points at which the equations have been solved.
+		'''
+
+		return self.time_history.view
+
+	def reserve_history(self, rows):
+		'''
+		Preallocate the stock histories.
+
+		Parameters
+		----------
+		rows : int
+			Total number of time points expected.
+		'''
+
+		self.stock_history.reserve(rows)
+		self.time_history.reserve(rows)
+		if self.method == 'LCT':
+			self.stage_history.reserve(rows)
+
 	def stock_equations(self, t, y):
 		'''
 		Calculates rate of change in stock at time t.
@@ -166,6 +245,9 @@ class SystemDynamics:
 			Differential equation values at time t.
 		'''
 
+		if self.sd_backend == 'numba':
+			return self.compiled_equations(t, y)
+
 		# Main stocks
 		S, I, Q, R = y[:4]
 
@@ -176,19 +258,12 @@ class SystemDynamics:
 		QR = (self.quarantine_fraction * I) / self.symptom_delay
 
 		if self.method == 'LCT':
-			Z = y[4:]
-			dZdt = np.zeros(self.delay_order)
-			outflow = QR
-			for i in range(self.delay_order):
-				inflow = outflow
-				outflow = self.a * Z[i]
-				dZdt[i] = inflow - outflow
-			QRR = outflow
+			dZdt, QRR = erlang_chain(y[4:], QR, self.a)
 
 		if self.method == 'interp':			
 			t_delay = t - self.quarantine_length
 			if t_delay >= 0:
-				I_delay = self.interpolator(t_delay)[1] 
+				I_delay = self.delayed_infections(t_delay)
 				QRR = (self.quarantine_fraction * I_delay) / self.symptom_delay
 			else:
 				QRR = 0
@@ -205,6 +280,54 @@ class SystemDynamics:
 
 		return output
 
+	def compiled_equations(self, t, y):
+		'''
+		Rate of change in stock at time t, from the compiled kernel.
+
+		Parameters are as for stock_equations; the lagged infections of the
+		interp method are looked up here and passed in.
+		'''
+
+		rate, QRR = 0.0, 0.0
+		if self.method == 'LCT':
+			rate = self.a
+		elif t - self.quarantine_length >= 0:
+			I_delay = self.delayed_infections(t - self.quarantine_length)
+			QRR = (self.quarantine_fraction * float(I_delay)) / \
+			self.symptom_delay
+
+		return kernels()['siqr_rhs'](y, self.contact_rate, self.infectivity,
+									 self.quarantine_fraction,
+									 self.infectivity_length,
+									 self.symptom_delay,
+									 float(self.vaccine_uptake), rate, QRR)
+
+	def jacobian(self, t, y):
+		'''
+		Jacobian of the stock equations for the LCT method.
+
+		Passed to LSODA in banded form, so the cost of each factorisation
+		grows linearly with the delay order.
+
+		Parameters
+		----------
+		t : float
+			Current time point.
+		y : array_like, shape (4+delay_order,)
+			Stock values at time t.
+
+		Returns
+		-------
+		array_like, shape (7, 4+delay_order)
+			Packed banded Jacobian (see core.erlang.lct_banded_jacobian).
+		'''
+
+		block = siqr_jacobian(y, self.contact_rate, self.infectivity,
+							  self.quarantine_fraction, self.infectivity_length,
+							  self.symptom_delay, self.vaccine_uptake)
+
+		return lct_banded_jacobian(block, self.delay_order, self.a)
+
 	def solve(self, t):
 		'''
 		Solves the stock differential equations until time t.
@@ -213,81 +336,170 @@ class SystemDynamics:
 		----------
 		t : float
 			Solve until this time.
-		method : str
-			Method for solving. 
-		rtol : float
-			Controls relative accuracy when using solve_ivp.
 		'''
 
-		if self.method == 'LCT':
-			
-			# Initial conditions
-			y0 = [self.S[-1], self.I[-1], self.Q[-1], self.R[-1]]
-			y0 = np.concatenate((y0, self.Z[-1]), axis=None)
-		
-			# Time domain
-			time_domain = [self.time[-1], t]
-		
-			# Solve stock equations
-			solutions = solve_ivp(self.stock_equations, time_domain, y0, 
-								  dense_output=True, method='LSODA')
-		
-			# Append interpolator
-			if self.interpolator: 
-				# Extract and append time points
-				ts = np.append(self.interpolator.ts, solutions.sol.ts[1:])
-				# Extract and append list of interpolant objects
-				interpolants = self.interpolator.interpolants + solutions.sol.interpolants
-				self.interpolator = OdeSolution(ts, interpolants)
-			else: 
-				self.interpolator = solutions.sol
-
-			# Return last values
-			S, I, Q, R = self.interpolator(t)[:4]
-			Z = self.interpolator(t)[4:]
-			
-			# Update stock values
-			self.S = np.append(self.S, S)
-			self.I = np.append(self.I, I)
-			self.Q = np.append(self.Q, Q)
-			self.R = np.append(self.R, R)
-			self.Z = np.vstack((self.Z, solutions.y[4:,-1]))
-			self.time = np.append(self.time, t)	
-
-		if self.method == 'interp':
-			
-			while self.time[-1] < t:
-				# Solve until...
+		while self.time[-1] < t:
+			# Solve until...
+			if self.method == 'LCT':
+				tmax = t
+			else:
 				tmax = min(self.time[-1] + self.quarantine_length - 1, t)
-				
-				# Initial conditions
-				y0 = [self.S[-1], self.I[-1], self.Q[-1], self.R[-1]]
-			
-				# Time domain
-				time_domain = [self.time[-1], tmax]
-			
-				# Solve stock equations
-				solutions = solve_ivp(self.stock_equations, time_domain, y0, 
-									  dense_output=True, method='LSODA')
-			
+
+			# Solve stock equations
+			with self.instrumentation.phase('solve'):
+				if self.integrator == 'persistent':
+					ts, interpolants, y = self.advance(tmax)
+				else:
+					ts, interpolants, y = self.integrate(tmax)
+
+			with self.instrumentation.phase('interpolator'):
 				# Append interpolator
-				if self.interpolator: 
-					# Extract and append time points
-					ts = np.append(self.interpolator.ts, solutions.sol.ts[1:])
-					# Extract and append list of interpolant objects
-					interpolants = self.interpolator.interpolants + solutions.sol.interpolants
-					# Create new OdeSolution object
-					self.interpolator = Interpolator(ts, interpolants, [0, self.population])
-				else: 
-					self.interpolator = Interpolator(solutions.sol.ts, 
-													 solutions.sol.interpolants, [0, self.population])
-	
+				self.extend_interpolator(ts, interpolants)
+
 				# Return last values
-				S, I, Q, R = self.interpolator(tmax)
-				
-				# Update stock values
-				self.S = np.append(self.S, S)
-				self.I = np.append(self.I, I)
-				self.Q = np.append(self.Q, Q)
-				self.R = np.append(self.R, R)
-				self.time = np.append(self.time, tmax)	
\ No newline at end of file
+				if self.method == 'LCT':
+					S, I, Q, R = y[:4]
+					self.stage_history.append(y[4:])
+				else:
+					S, I, Q, R = self.interpolator(tmax)
+
+			# Track the peak before older steps are dropped
+			with self.instrumentation.phase('outcomes'):
+				self.outcomes.update(ts, interpolants)
+
+			# Update stock values
+			self.stock_history.append([S, I, Q, R])
+			self.time_history.append(tmax)
+
+		# Drop dense output no longer needed
+		if self.dense_output == 'window':
+			if self.method == 'LCT':
+				self.interpolator.trim(self.time[-1])
+			else:
+				self.delayed_infections.trim(self.time[-1] -
+											 self.quarantine_length - 1)
+
+	def initial_state(self):
+		'''
+		Return the state at the last solved time point.
+
+		Returns
+		-------
+		array_like, shape (4,) or (4+delay_order,)
+			Stock values, followed by the intermediate stocks for LCT.
+		'''
+
+		y0 = [self.S[-1], self.I[-1], self.Q[-1], self.R[-1]]
+		if self.method == 'LCT':
+			y0 = np.concatenate((y0, self.Z[-1]), axis=None)
+
+		return y0
+
+	def solver_options(self):
+		'''
+		Return the options passed to LSODA.
+
+		Returns
+		-------
+		dict
+			Banded Jacobian for the LCT method, nothing otherwise.
+		'''
+
+		if self.method == 'LCT':
+			return {'jac': self.jacobian, 'lband': LOWER_BAND,
+					'uband': UPPER_BAND}
+		return {}
+
+	def integrate(self, t):
+		'''
+		Integrate from the last solved time point to t with a new solver.
+
+		Parameters
+		----------
+		t : float
+			Solve until this time.
+
+		Returns
+		-------
+		ts : array_like, shape (m+1,)
+			Boundaries of the solver steps.
+		interpolants : list of DenseOutput
+			Dense output of every step.
+		y : array_like, shape (4,) or (4+delay_order,)
+			State at time t.
+		'''
+
+		solutions = solve_ivp(self.stock_equations, [self.time[-1], t],
+							  self.initial_state(), dense_output=True,
+							  method='LSODA', **self.solver_options())
+		self.instrumentation.solver(solutions.nfev, solutions.njev,
+									solutions.nlu)
+
+		return solutions.sol.ts, solutions.sol.interpolants, solutions.y[:,-1]
+
+	def advance(self, t):
+		'''
+		Advance the persistent solver to time t.
+
+		The solver is created on the first call. If vaccine_uptake has changed
+		since the last call, the change is applied as a discontinuity with a
+		cheap restart of the solver.
+
+		Parameters
+		----------
+		t : float
+			Solve until this time.
+
+		Returns
+		-------
+		ts : list of float
+			Boundaries of the solver steps.
+		interpolants : list of DenseOutput
+			Dense output of every step.
+		y : array_like, shape (4,) or (4+delay_order,)
+			State at time t.
+		'''
+
+		# Counters before advancing (LSODA resets njev and nlu on a restart)
+		nfev = njev = nlu = 0
+		if self.solver is None:
+			self.solver = PersistentLSODA(self.stock_equations, self.time[-1],
+										  self.initial_state(), t,
+										  **self.solver_options())
+			self.solver_uptake = self.vaccine_uptake
+		elif self.vaccine_uptake != self.solver_uptake:
+			self.solver.restart()
+			self.solver_uptake = self.vaccine_uptake
+			nfev = self.solver.nfev
+		else:
+			nfev, njev, nlu = self.solver.nfev, self.solver.njev, self.solver.nlu
+
+		ts, interpolants = self.solver.advance(t)
+		self.instrumentation.solver(self.solver.nfev - nfev,
+									self.solver.njev - njev,
+									self.solver.nlu - nlu)
+
+		return ts, interpolants, self.solver.y
+
+	def extend_interpolator(self, ts, interpolants):
+		'''
+		Append solver steps to the interpolator.
+
+		Parameters
+		----------
+		ts : array_like, shape (m+1,)
+			Boundaries of the solver steps.
+		interpolants : list of DenseOutput
+			Dense output of every step.
+		'''
+
+		if self.interpolator:
+			# Append the new steps
+			self.interpolator.extend(ts, interpolants)
+		elif self.method == 'LCT':
+			self.interpolator = DenseSolution(ts, interpolants)
+		else:
+			# Bounded for the interp method
+			self.interpolator = DenseSolution(ts, interpolants,
+											  [0, self.population])
+			self.delayed_infections = DelayHistory(self.interpolator, 1)
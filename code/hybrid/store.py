@@ -0,0 +1,67 @@
+# Import required packages
+import tempfile
+import numpy as np
+from hybrid.cache import PopulationCache
+
+class PopulationStore(PopulationCache):
+	'''
+	Out-of-core store of generated populations, for populations larger
+	than memory.
+
+	Entries are laid out as in PopulationCache, but they are generated
+	straight into memory-mapped files rather than in memory. They hold
+	float32 thresholds and the CSR adjacency only (the mmap engine of
+	AgentBasedModel needs no threshold-sorted index). The vaccination state
+	of each run is kept in scratch files in the same folder (see scratch),
+	so the resident memory of a run does not grow with the population.
+	'''
+
+	def get_or_create(self, key, create):
+		'''
+		Load the arrays for a key, generating them into the store if needed.
+
+		Parameters
+		----------
+		key : dict
+			JSON-serialisable settings that determine the population.
+		create : callable
+			Called as create(allocate) on a miss, where
+			allocate(name, shape, dtype) returns a writable memory-mapped
+			array stored in the entry.
+
+		Returns
+		-------
+		dict
+			Read-only memory-mapped arrays.
+		'''
+
+		arrays = self.load(key)
+		if arrays is None:
+			self.write(key, create)
+			arrays = self.load(key)
+			self.evict(keep=self.entry_name(key))
+
+		return arrays
+
+	def scratch(self, shape, dtype):
+		'''
+		Zeroed array backed by a scratch file in the store's folder.
+
+		The file is unlinked as soon as it is created, so it is removed
+		once the array is no longer used.
+
+		Parameters
+		----------
+		shape : int or tuple of int
+			Shape of the array.
+		dtype : data-type
+			Type of the elements.
+
+		Returns
+		-------
+		memmap
+			Writable memory-mapped array.
+		'''
+
+		with tempfile.TemporaryFile(dir=self.directory) as f:
+			return np.memmap(f, dtype=dtype, mode='w+', shape=shape)
@@ -0,0 +1,170 @@
+# Import required packages
+import copy
+import math
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from joblib import cpu_count
+
+# State of the worker process, set up once by initialise_worker
+worker = {}
+
+def initialise_worker(function, cache):
+	'''
+	Set up a worker process of a ReplicationPool.
+
+	Parameters
+	----------
+	function : callable
+		Model run, function(parameters, seed=seed, cache=cache).
+	cache : PopulationCache or None
+		Population cache kept by the worker, so the checksums of each
+		entry are verified once per worker rather than once per task.
+	'''
+
+	worker['function'] = function
+	worker['cache'] = cache
+
+def run_batch(parameters, seeds):
+	'''
+	Run replications of one parameter set in a worker process.
+
+	Parameters
+	----------
+	parameters : dict
+		Parameters of the model. Each replication gets its own copy.
+	seeds : list of int
+		Seed of each replication.
+
+	Returns
+	-------
+	array_like, shape (len(seeds),)
+		Result of each replication.
+	'''
+
+	function = worker['function']
+	results = np.empty(len(seeds))
+	for i, seed in enumerate(seeds):
+		results[i] = function(copy.deepcopy(parameters), seed=seed,
+							  cache=worker['cache'])
+
+	return results
+
+class ReplicationPool:
+	'''
+	Pool of worker processes kept alive across parameter sets.
+
+	Workers are started once and set up once (the model function and the
+	population cache are sent to each worker when it starts, not with every
+	task). Seeds are sent in batches, one task per batch, and the results of
+	a batch come back as one array. Each replication runs on its own copy of
+	the parameters with its own seed, so results are identical to running
+	the replications one after another.
+
+	Attributes
+	----------
+	n_workers : int
+		Number of worker processes.
+	batch_size : int or None
+		Number of seeds per task, or None to split the seeds of each
+		parameter set evenly across the workers.
+	'''
+
+	def __init__(self, function, n_workers=None, cache=None, batch_size=None):
+		'''
+		Start a pool of worker processes.
+
+		Parameters
+		----------
+		function : callable
+			Model run, function(parameters, seed=seed, cache=cache),
+			returning a float. It must be importable by name (not a lambda
+			or partial) for the worker processes.
+		n_workers : int, optional
+			Number of worker processes. Default is the number of CPUs.
+		cache : PopulationCache, optional
+			Population cache passed to every model run.
+		batch_size : int, optional
+			Number of seeds per task. Default splits the seeds of each
+			parameter set evenly across the workers.
+		'''
+
+		self.n_workers = n_workers if n_workers is not None else cpu_count()
+		self.batch_size = batch_size
+		self.executor = ProcessPoolExecutor(self.n_workers,
+											initializer=initialise_worker,
+											initargs=(function, cache))
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		'''
+		Shut down the worker processes.
+		'''
+
+		self.executor.shutdown()
+
+	def batches(self, seeds):
+		'''
+		Split seeds into the batches sent as tasks.
+
+		Parameters
+		----------
+		seeds : list of int
+			Seeds of one parameter set.
+
+		Returns
+		-------
+		list of list of int
+			Consecutive batches of seeds.
+		'''
+
+		seeds = list(seeds)
+		size = self.batch_size or max(1, math.ceil(len(seeds) / self.n_workers))
+
+		return [seeds[i:i+size] for i in range(0, len(seeds), size)]
+
+	def submit(self, parameters, seeds):
+		'''
+		Run one batch of replications.
+
+		Parameters
+		----------
+		parameters : dict
+			Parameters of the model.
+		seeds : list of int
+			Seed of each replication.
+
+		Returns
+		-------
+		Future
+			Resolves to the array of results (see run_batch).
+		'''
+
+		return self.executor.submit(run_batch, parameters, list(seeds))
+
+	def map(self, parameters, seeds):
+		'''
+		Run replications of one parameter set across the workers.
+
+		Parameters
+		----------
+		parameters : dict
+			Parameters of the model.
+		seeds : list of int
+			Seed of each replication.
+
+		Returns
+		-------
+		array_like, shape (len(seeds),)
+			Result of each replication, in the order of the seeds.
+		'''
+
+		futures = [self.submit(parameters, batch)
+				   for batch in self.batches(seeds)]
+
+		return np.concatenate([future.result() for future in futures] or
+							  [np.empty(0)])
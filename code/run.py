@@ -1,20 +1,21 @@
-# Import required packages / files
-from hybrid.hybrid import HybridSim
-from sd.model import SDModel
+# Import required packages / files (models and heavy packages are imported
+# by the stages that need them, so a single solve starts quickly)
+import argparse
 import json
 import os
-import sys
 import time
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-import math
-from scipy.stats import t
-from joblib import Parallel, delayed, cpu_count
+
+# Folders of the repository, independent of the working directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PARAMETERS = os.path.join(ROOT, 'parameters')
+FIGURES = os.path.join(ROOT, 'figures')
+RESULTS = os.path.join(ROOT, 'results')
+CACHE = os.path.join(ROOT, 'cache')
 
 def import_parameters():
 	
-	data_path = '../parameters'
+	data_path = PARAMETERS
 	json_file = os.path.join(data_path, 'parameters.json')
 	with open(json_file, "r", encoding="utf-8") as f:
 		json_content = json.load(f)
@@ -22,27 +23,97 @@ def import_parameters():
 
 	return parameters
 
-def run_sd_model(pars, method='interp', delay_order=None):
+def run_sd_model(pars, method='interp', delay_order=None, solver='LSODA',
+                 cache=None, times=None):
 
+    from sd.model import SDModel
     pars['delay_order'] = delay_order
-    model = SDModel(pars, method=method)
+    model = SDModel(pars, method=method, solver=solver)
     start = time.time()
     model.solve(80)
     end = time.time()
     elapsed = end - start
+    # Keep the solution so later stages do not solve it again
+    if cache is not None:
+        cache.put(cache.key(pars, method, 80, times, solver),
+                  model.interpolator(times)[:4])
     return elapsed
 
-def run_hybrid_model(pars, time_domain, seed):
+def run_hybrid_model(pars, seed, cache=None):
+    from hybrid.hybrid import HybridSim
     pars['general']['main_seed'] = seed
-    model = HybridSim(pars)
+    model = HybridSim(pars, cache)
     model.simulate()
-    infections = model.interpolator(time_domain)[1]
-    return np.max(infections)
+    return model.summary()
+
+def peak_infections(pars, seed, cache=None):
+    # The peak is found exactly during the run, which can stop once fewer
+    # than one person is infected without changing it
+    pars['general'].setdefault('stop_tolerance', 1)
+    return run_hybrid_model(pars, seed, cache)['peak_infections']
+
+def select_order(pars, args, horizon, cache=None):
+	'''
+	Set the delay order to the cheapest whose error is within --tolerance,
+	and print the order, its error and its cost.
+	'''
+
+	from sd.order import select_delay_order
+
+	selection = select_delay_order(pars, args.tolerance, args.stock, horizon,
+								   max_order=args.max_order, cache=cache)
+	pars['delay_order'] = selection['delay_order']
+	print(f"Delay order: {selection['delay_order']} (error on {args.stock} "
+		  f"{selection['error']:.2f}, tolerance {args.tolerance}; solved in "
+		  f"{selection['cost']*1000:.1f} ms; {len(selection['errors'])} "
+		  f"orders tried).")
+
+	return selection
+
+def sd_command(args):
+	'''
+	Solve one system dynamics model and print its outcomes.
+	'''
+
+	from sd.cache import SolutionCache
+
+	parameters = import_parameters()
+	pars = parameters['system_dynamics']
+	pars['delay_order'] = args.delay_order if args.method == 'LCT' else None
+	horizon = args.horizon or parameters['general']['horizon']
+	cache = SolutionCache(os.path.join(CACHE, 'sd') if args.cache else None)
+	if args.method == 'LCT' and args.tolerance:
+		select_order(pars, args, horizon, cache)
+
+	start = time.perf_counter()
+	time_domain = np.linspace(0, horizon, 1001)
+	S, I, Q, R = cache.stocks(pars, args.method, horizon, time_domain,
+							  args.solver)
+	elapsed = time.perf_counter() - start
+
+	print(f'Solved in {elapsed*1000:.1f} ms' +
+		  (' (cached).' if cache.hits else '.'))
+	print(f'Peak infections: {np.max(I):.2f} on day {time_domain[np.argmax(I)]:.2f}.')
+	print(f'Peak quarantined: {np.max(Q):.2f}. Min. value: {np.min(Q):.4f}.')
+	print(f'Final size: {pars["population"] - S[-1]:.2f}.')
+
+	if args.output:
+		np.savetxt(args.output, np.column_stack((time_domain, S, I, Q, R)),
+				   delimiter=',', header='time,S,I,Q,R', comments='')
+
+def erlang_benchmark_command(args):
+	'''
+	Compare the Erlang approximations of the delay with interpolation:
+	plot the quarantined stock and tabulate run times and errors.
+	'''
+
+	import math
+	import pandas as pd
+	import matplotlib.pyplot as plt
+	from scipy.stats import t
+	from sd.cache import SolutionCache
+	from sd.ensemble import SDEnsemble
 
-def main():
-	
-	main_start = time.time()
-	
 	# Load parameters
 	parameters = import_parameters()
 
@@ -54,19 +125,19 @@ def main():
 
 	print('Plotting Erlang distributions up to order 100.')
 
-	# Run the SD models for different methods of solving the pipeline delay
+	# Run the SD models for different methods of solving the pipeline delay,
+	# all at once as an ensemble
 	results = {}
-	model = SDModel(parameters['system_dynamics'], method='interp')
-	model.solve(parameters['general']['horizon'])
-	results['interpolation'] = model.interpolator(time_domain)[2]
-	print(f'Method: interpolation. Min. value: {min(results['interpolation'])}.')
 	values = [1,2,3,4,5,10,25,50,100]
-	for i in values:
-	    parameters['system_dynamics']['delay_order'] = i
-	    model = SDModel(parameters['system_dynamics'], method='LCT')
-	    model.solve(parameters['general']['horizon'])
-	    results[f'Order_{i}'] = model.interpolator(time_domain)[2]
-	    minimum = min(results[f'Order_{i}'])
+	members = [parameters['system_dynamics']] + \
+	[dict(parameters['system_dynamics'], delay_order=i) for i in values]
+	ensemble = SDEnsemble(members, ['interp'] + ['LCT'] * len(values))
+	ensemble.solve(parameters['general']['horizon'])
+	stocks = ensemble.stocks(time_domain)
+	results['interpolation'] = stocks[0, 2]
+	print(f'Method: interpolation. Min. value: {min(results["interpolation"])}.')
+	for k, i in enumerate(values):
+	    results[f'Order_{i}'] = stocks[k+1, 2]
 
 	# Plot the results
 	fig = plt.figure(figsize=(12,5))
@@ -82,22 +153,31 @@ def main():
 	plt.yticks(fontsize=11)
 	ax.legend(loc=[0,1.025], ncol=5, fontsize=12)
 	ax.grid(linestyle=':')
-	data_path = '../figures/pipeline-delay-plt.png'
+	data_path = os.path.join(FIGURES, 'pipeline-delay-plt.png')
 	fig.savefig(data_path, bbox_inches='tight', dpi=300)
+	if args.show:
+		plt.show()
+	plt.close(fig)
 
 	print('Completed.')
 
 	print('Testing run times and errors for the SD model.')
 
-	# Calculate run time across 100 repeats for n=1,10,100,1000
-	N_RUNS = 100
+	# Calculate run time across 100 repeats for n=1,10,100,1000, keeping the
+	# solutions of the first repeat for the errors
+	N_RUNS = args.runs
 	values = [10**x for x in range(4)]
-	results = np.zeros((len(values)+1)*N_RUNS).reshape((len(values)+1, N_RUNS))
+	cache = SolutionCache(os.path.join(CACHE, 'sd') if args.cache else None)
+	results = np.zeros((len(values)+2)*N_RUNS).reshape((len(values)+2, N_RUNS))
 	for run in range(N_RUNS):
-		results[0, run] = run_sd_model(parameters['system_dynamics'])
+		keep = {'cache': cache if run == 0 else None, 'times': time_domain}
+		results[0, run] = run_sd_model(parameters['system_dynamics'], **keep)
 		for i, j in enumerate(values):
 			results[i+1, run] = run_sd_model(parameters['system_dynamics'], 
-											 method='LCT', delay_order=j)
+											 method='LCT', delay_order=j,
+											 **keep)
+		results[-1, run] = run_sd_model(parameters['system_dynamics'],
+										solver='RK4', **keep)
 		if (run+1) % 10 == 0:
 			print(f'{((run+1)/N_RUNS) * 100}% complete.')
 
@@ -110,75 +190,92 @@ def main():
 	# Store results in a table
 	comp_results = pd.DataFrame()
 	comp_results['Method'] = ['Interpolation', 'Erlang: n=1', 'Erlang: n=10',
-							  'Erlang: n=100', 'Erlang: n=1000']
+							  'Erlang: n=100', 'Erlang: n=1000', 'Fixed-step RK4']
 	comp_results['Mean'] = np.round(means, decimals=4)
 	comp_results['Lower'] = np.round(lowers, decimals=4)
 	comp_results['Upper'] = np.round(uppers, decimals=4)
 
 	# Calculate errors for Erlang approximations
-	q_vals = np.zeros((len(values)+1)*len(time_domain))
-	q_vals = q_vals.reshape(len(values)+1, len(time_domain))
-	model = SDModel(parameters['system_dynamics'], method='interp')
-	model.solve(80)
-	q_vals[0] = model.interpolator(time_domain)[2]
+	q_vals = np.zeros((len(values)+2)*len(time_domain))
+	q_vals = q_vals.reshape(len(values)+2, len(time_domain))
+	pars = parameters['system_dynamics']
+	q_vals[0] = cache.stocks(pars, 'interp', 80, time_domain)[2]
 	for i, j in enumerate(values):
 	    parameters['system_dynamics']['delay_order'] = j
-	    model = SDModel(parameters['system_dynamics'], method='LCT')
-	    model.solve(80)
-	    q_vals[i+1] = model.interpolator(time_domain)[2]
+	    q_vals[i+1] = cache.stocks(pars, 'LCT', 80, time_domain)[2]
+	q_vals[-1] = cache.stocks(pars, 'interp', 80, time_domain, solver='RK4')[2]
 	max_error = np.round(np.max(abs(q_vals[0] - q_vals[1:]), axis=1), decimals=2)
 	max_error = np.concatenate(([None], max_error))
 	comp_results['Error'] = max_error
 
 	# Save pandas data frame as CSV
-	data_path = '../figures/comp-results.csv'
+	data_path = os.path.join(FIGURES, 'comp-results.csv')
 	comp_results.to_csv(data_path, index=False)
 
+def hybrid_command(args):
+	'''
+	Run one replication of the hybrid model and print its outcomes, with
+	the error against daily coupling if the coupling is not daily.
+	'''
+
+	from hybrid.cache import PopulationCache
+	from hybrid.coupling import coupling_error
+	from hybrid.hybrid import HybridSim
+	from sd.cache import SolutionCache
+
+	parameters = import_parameters()
+	parameters['system_dynamics']['method'] = args.method
+	if args.method == 'LCT':
+		parameters['system_dynamics']['delay_order'] = args.delay_order
+	if args.method == 'LCT' and args.tolerance:
+		select_order(parameters['system_dynamics'], args,
+					 parameters['general']['horizon'],
+					 SolutionCache(os.path.join(CACHE, 'sd')
+								   if args.cache else None))
+	parameters['general'].update(
+		coupling=args.coupling, coupling_interval=args.coupling_interval,
+		max_coupling_interval=args.max_coupling_interval, main_seed=args.seed)
+	if args.coupling_tolerance is not None:
+		parameters['general']['coupling_tolerance'] = args.coupling_tolerance
+	cache = PopulationCache(CACHE) if args.cache else None
+
+	start = time.perf_counter()
+	model = HybridSim(parameters, cache)
+	model.simulate()
+	summary = model.summary()
+	summary['wall'] = time.perf_counter() - start
+	if args.coupling != 'fixed' or args.coupling_interval != 1:
+		summary['coupling_error'] = coupling_error(parameters, cache, model)
+	print(json.dumps(summary, indent=1))
+
+def sweep_command(args):
+	'''
+	Run the scenario grid of the hybrid model and plot the mean peak number
+	of infections.
+	'''
+
+	import pandas as pd
+	import matplotlib.pyplot as plt
+	from hybrid.cache import PopulationCache
+	from scenarios import load_scenarios, ScenarioRunner
+
 	# Now run the hybrid model
 	print('Running hybrid simulation model...')
 
-	# Number of replications
-	N_REPLICATIONS = 10
+	# Scenarios, run from fresh parameters on a warm pool of workers sharing
+	# cached populations, and saved as each batch completes
+	spec = load_scenarios(args.scenarios)
+	runner = ScenarioRunner(peak_infections, import_parameters(), spec,
+							os.path.join(RESULTS, 'scenarios'),
+							n_jobs=args.jobs, cache=PopulationCache(CACHE))
+	records = pd.DataFrame(runner.run())
 	
-	# Scenarios
-	methods = ['interp', 'LCT']
-	scenarios = ['Baseline', 'Increased Quarantine', 
-	             'Increased Quarantine + Vaccinations']
+	# Mean peak number of infections for each method and scenario
+	scenarios = list(spec['axes']['scenario'])
+	means = records.groupby(['method', 'scenario'], sort=False)['result'].mean()
 	results_dict = {}
-	
-	for method in methods:
-	
-	    parameters['system_dynamics']['method'] = method
-	    print(f'Method: {method}.')
-	    if method == 'LCT':
-	        parameters['system_dynamics']['delay_order'] = 100
-	
-	    results = np.zeros(len(scenarios))
-	
-	    for i, scenario in enumerate(scenarios):
-	    
-	        print(f'Currently running: {scenario} Scenario.')
-	    
-	        # Change relevant parameters
-	        if i == 0:
-	            parameters['system_dynamics']['quarantine_fraction'] = 0.5
-	            parameters['agent_based']['max_daily_vax'] = 50
-	        if i == 1: 
-	            parameters['system_dynamics']['quarantine_fraction'] = 0.9
-	            parameters['agent_based']['max_daily_vax'] = 50
-	        if i == 2:
-	            parameters['system_dynamics']['quarantine_fraction'] = 0.9
-	            parameters['agent_based']['max_daily_vax'] = 1000
-	    
-	        # Store maximum no. of infections for each replication
-			# We'll use parallel processing to speed things up
-	        loop_results = Parallel(n_jobs=cpu_count())(
-	            delayed(run_hybrid_model)(parameters, time_domain, j)
-	            for j in range(N_REPLICATIONS)
-	        )
-	        results[i] = np.mean(loop_results)
-	
-	    results_dict[method] = results
+	for method in spec['axes']['method']:
+	    results_dict[method] = means[method].reindex(scenarios).to_numpy()
 
 	# Plot the results
 	x = np.arange(len(scenarios))
@@ -205,13 +302,94 @@ def main():
 	ax.set_ylim(0, 4000)
 	plt.xticks(fontsize=11)
 	plt.yticks(fontsize=11)
-	plt.show()
-	fig.savefig('../figures/peak-infections-plt.png', dpi=300)
+	fig.savefig(os.path.join(FIGURES, 'peak-infections-plt.png'), dpi=300)
+	if args.show:
+		plt.show()
+	plt.close(fig)
+
+def add_order_arguments(parser):
+	'''
+	Options choosing the delay order from a tolerance.
+	'''
+
+	parser.add_argument('--tolerance', type=float,
+						help='use the cheapest delay order whose largest '
+							 'error against interp is within this (LCT only)')
+	parser.add_argument('--stock', choices=['S', 'I', 'Q', 'R'], default='Q',
+						help='stock the tolerance applies to')
+	parser.add_argument('--max-order', type=int, default=1000,
+						help='largest delay order considered')
+
+def main(argv=None):
+
+	parser = argparse.ArgumentParser(
+		description='Run the system dynamics and hybrid models. Without a '
+					'command, runs erlang-benchmark then sweep.')
+	parser.add_argument('--show', action='store_true',
+						help='show figures as well as saving them')
+	commands = parser.add_subparsers(dest='command')
+
+	solve = commands.add_parser('sd', help='solve one system dynamics model')
+	solve.add_argument('--method', choices=['interp', 'LCT'], default='interp')
+	solve.add_argument('--delay-order', type=int, default=100,
+					   help='order of the Erlang delay (LCT only)')
+	solve.add_argument('--solver', choices=['LSODA', 'RK4'], default='LSODA')
+	add_order_arguments(solve)
+	solve.add_argument('--horizon', type=float)
+	solve.add_argument('--output', help='CSV file for the stocks')
+	solve.add_argument('--cache', action='store_true',
+					   help='reuse solutions cached on disk')
+
+	benchmark = commands.add_parser(
+		'erlang-benchmark',
+		help='compare Erlang approximations of the delay with interpolation')
+	benchmark.add_argument('--runs', type=int, default=100,
+						   help='timed repeats of each model')
+	benchmark.add_argument('--cache', action='store_true',
+						   help='reuse solutions cached on disk')
+
+	single = commands.add_parser('hybrid', help='run one hybrid replication')
+	single.add_argument('--method', choices=['interp', 'LCT'],
+						default='interp')
+	single.add_argument('--delay-order', type=int, default=100,
+						help='order of the Erlang delay (LCT only)')
+	add_order_arguments(single)
+	single.add_argument('--seed', type=int, default=0)
+	single.add_argument('--coupling', choices=['fixed', 'adaptive'],
+						default='fixed')
+	single.add_argument('--coupling-interval', type=float, default=1,
+						help='days between exchanges of the models (the '
+							 'shortest interval if adaptive)')
+	single.add_argument('--max-coupling-interval', type=float, default=7,
+						help='longest interval if adaptive')
+	single.add_argument('--coupling-tolerance', type=float,
+						help='largest change in the coupled quantities for '
+							 'which the adaptive interval is lengthened')
+	single.add_argument('--cache', action='store_true',
+						help='reuse cached populations')
+
+	grid = commands.add_parser('sweep', help='run the hybrid scenario grid')
+	grid.add_argument('--scenarios',
+					  default=os.path.join(PARAMETERS, 'scenarios.json'))
+	grid.add_argument('--jobs', type=int, help='worker processes')
+
+	args = parser.parse_args(argv)
+	if args.command is None:
+		# Full pipeline, with the default options of each stage
+		main_start = time.time()
+		show = ['--show'] if args.show else []
+		erlang_benchmark_command(parser.parse_args(show + ['erlang-benchmark']))
+		sweep_command(parser.parse_args(show + ['sweep']))
 
-	# Print the total run time
-	main_end = time.time()
-	main_elapsed = main_end - main_start
-	print(f'Total run time: {np.round(main_elapsed/3600, decimals=1)} hours.')
+		# Print the total run time
+		main_end = time.time()
+		main_elapsed = main_end - main_start
+		print(f'Total run time: {np.round(main_elapsed/3600, decimals=1)} hours.')
+	else:
+		commands = {'sd': sd_command,
+					'erlang-benchmark': erlang_benchmark_command,
+					'hybrid': hybrid_command, 'sweep': sweep_command}
+		commands[args.command](args)
 
 if __name__ == '__main__':
 	main()
\ No newline at end of file
@@ -0,0 +1,277 @@
+# Import required packages
+import copy
+import hashlib
+import itertools
+import json
+import os
+import uuid
+from concurrent.futures import as_completed
+from pool import ReplicationPool
+
+def load_scenarios(path):
+	'''
+	Read a scenario specification from a JSON file.
+
+	The file holds the number of replications and a set of named axes. Each
+	axis maps the name of every level to the parameter overrides it makes,
+	written as 'section.parameter': value. For example:
+
+		{"replications": 10,
+		 "axes": {"scenario": {"Baseline": {"agent_based.max_daily_vax": 50},
+		                       "Vaccinations": {"agent_based.max_daily_vax": 1000}}}}
+
+	Parameters
+	----------
+	path : str
+		Path to the JSON file.
+
+	Returns
+	-------
+	dict
+		Scenario specification.
+	'''
+
+	with open(path, 'r', encoding='utf-8') as f:
+		spec = json.load(f)
+
+	if not isinstance(spec.get('axes'), dict) or len(spec['axes']) == 0:
+		raise ValueError('Scenario file must define at least one axis.')
+
+	return spec
+
+def apply_overrides(parameters, overrides):
+	'''
+	Return a copy of the parameters with overrides applied.
+
+	Parameters
+	----------
+	parameters : dict
+		Parameters of the model, split into sections.
+	overrides : dict
+		Values to set, keyed by 'section.parameter'.
+
+	Returns
+	-------
+	dict
+		Updated copy; the original parameters are left untouched.
+	'''
+
+	parameters = copy.deepcopy(parameters)
+	for key, value in overrides.items():
+		section, _, name = key.partition('.')
+		if section not in parameters or not name:
+			raise ValueError(f'Unknown parameter {key}.')
+		parameters[section][name] = value
+
+	return parameters
+
+def expand(spec):
+	'''
+	Expand a scenario specification into independent jobs.
+
+	Every combination of one level from each axis is run once for each
+	replication, with the replication number as the seed.
+
+	Parameters
+	----------
+	spec : dict
+		Scenario specification (see load_scenarios).
+
+	Returns
+	-------
+	list of dict
+		Jobs in grid order, each with the level of every axis (labels),
+		the combined overrides and the seed.
+	'''
+
+	axes = spec['axes']
+	jobs = []
+	for levels in itertools.product(*[list(axis) for axis in axes.values()]):
+		labels = dict(zip(axes, levels))
+		overrides = {}
+		for name, level in labels.items():
+			overrides.update(axes[name][level])
+		for seed in range(spec.get('replications', 1)):
+			jobs.append({'labels': labels, 'overrides': overrides,
+						 'seed': seed})
+
+	return jobs
+
+def save_result(path, parameters, seed, result):
+	'''
+	Save the result of one job.
+
+	The result is written to a temporary file that is then renamed, so a
+	result file is either complete or absent if the run is interrupted.
+
+	Parameters
+	----------
+	path : str
+		File the result is saved to.
+	parameters : dict
+		Parameters of the job.
+	seed : int
+		Seed of the job.
+	result : float
+		Result of the job.
+	'''
+
+	temporary = f'{path}.{uuid.uuid4().hex}.tmp'
+	with open(temporary, 'w', encoding='utf-8') as f:
+		json.dump({'parameters': parameters, 'seed': seed,
+				   'result': float(result)}, f)
+	os.replace(temporary, path)
+
+class ScenarioRunner:
+	'''
+	Runs a grid of scenarios with checkpointing.
+
+	Jobs run on a ReplicationPool, with the seeds of each combination of
+	levels sent in batches. Each job works on its own copy of the
+	parameters, and its result is saved as soon as its batch finishes, in a
+	file named after a hash of the model run, the parameters and the seed.
+	Jobs with a saved result are skipped, so an interrupted sweep resumes
+	where it stopped, and changing a parameter only reruns the jobs it
+	affects.
+
+	Attributes
+	----------
+	function : callable
+		Model run, function(parameters, seed=seed, cache=cache).
+	parameters : dict
+		Base parameters the overrides are applied to.
+	spec : dict
+		Scenario specification (see load_scenarios).
+	directory : str
+		Folder holding the saved results.
+	n_jobs : int or None
+		Number of worker processes.
+	cache : PopulationCache or None
+		Population cache passed to every model run.
+	'''
+
+	def __init__(self, function, parameters, spec, directory, n_jobs=None,
+				 cache=None):
+		'''
+		Initialise a scenario runner.
+
+		Parameters
+		----------
+		function : callable
+			Model run, function(parameters, seed=seed, cache=cache),
+			returning a float. Its result must depend only on the parameters
+			and seed, and it must be importable by name (not a lambda or
+			partial) for the worker processes.
+		parameters : dict
+			Base parameters the overrides are applied to.
+		spec : dict
+			Scenario specification (see load_scenarios).
+		directory : str
+			Folder holding the saved results. Created if needed.
+		n_jobs : int, optional
+			Number of worker processes. Default is the number of CPUs.
+		cache : PopulationCache, optional
+			Population cache passed to every model run.
+		'''
+
+		self.function = function
+		self.parameters = parameters
+		self.spec = spec
+		self.directory = directory
+		self.n_jobs = n_jobs
+		self.cache = cache
+		os.makedirs(self.directory, exist_ok=True)
+
+	def job_path(self, parameters, seed):
+		'''
+		Return the result file of a job.
+
+		Parameters
+		----------
+		parameters : dict
+			Parameters of the job.
+		seed : int
+			Seed of the job.
+
+		Returns
+		-------
+		str
+			Path named after a hash of the model run, parameters and seed.
+		'''
+
+		function = f'{self.function.__module__}.{self.function.__qualname__}'
+		key = {'function': function, 'parameters': parameters, 'seed': seed}
+		canonical = json.dumps(key, sort_keys=True, separators=(',', ':'))
+		name = hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+		return os.path.join(self.directory, f'{name}.json')
+
+	def group(self, jobs):
+		'''
+		Group jobs that differ only in their seed.
+
+		Parameters
+		----------
+		jobs : list of dict
+			Jobs from expand.
+
+		Returns
+		-------
+		list of list of dict
+			Jobs of each combination of levels, in grid order.
+		'''
+
+		groups = {}
+		for job in jobs:
+			key = json.dumps(job['labels'], sort_keys=True)
+			groups.setdefault(key, []).append(job)
+
+		return list(groups.values())
+
+	def run(self):
+		'''
+		Run every job without a saved result, then collect all results.
+
+		Returns
+		-------
+		list of dict
+			One record per job in grid order, with the level of every axis,
+			the seed and the result.
+		'''
+
+		# Resolve the parameters and result file of every job
+		jobs = expand(self.spec)
+		for job in jobs:
+			job['parameters'] = apply_overrides(self.parameters,
+												job['overrides'])
+			job['path'] = self.job_path(job['parameters'], job['seed'])
+
+		# Run the jobs not yet completed
+		pending = [job for job in jobs if not os.path.exists(job['path'])]
+		print(f'{len(jobs) - len(pending)} of {len(jobs)} jobs already '
+			  'completed.')
+
+		# Submit every batch before waiting, so the workers stay busy across
+		# combinations, and save each batch as it finishes
+		with ReplicationPool(self.function, self.n_jobs, self.cache) as pool:
+			batches = {}
+			for group in self.group(pending):
+				for batch in pool.batches(range(len(group))):
+					jobs_in_batch = [group[i] for i in batch]
+					future = pool.submit(group[0]['parameters'],
+										 [job['seed'] for job in jobs_in_batch])
+					batches[future] = jobs_in_batch
+			for future in as_completed(batches):
+				for job, result in zip(batches[future], future.result()):
+					save_result(job['path'], job['parameters'], job['seed'],
+								result)
+
+		# Collect the results
+		records = []
+		for job in jobs:
+			with open(job['path'], 'r', encoding='utf-8') as f:
+				result = json.load(f)['result']
+			records.append({**job['labels'], 'seed': job['seed'],
+							'result': result})
+
+		return records
@@ -0,0 +1,235 @@
+# Import required packages / files
+from collections import OrderedDict
+import copy
+import hashlib
+import json
+import numpy as np
+from sd.model import SDModel
+from core.cache import ArrayCache
+
+# Parameters read by SDModel, for every method and solver
+PARAMETERS = ['contact_rate', 'infectivity', 'symptom_delay',
+			  'quarantine_length', 'quarantine_fraction', 'infectivity_length',
+			  'population']
+
+class SolutionCache:
+	'''
+	Content-addressed cache of system dynamics solutions.
+
+	An entry holds the dense output of a solved SDModel (the stocks S, I,
+	Q and R) sampled at a set of times, keyed by a hash of the canonical
+	form of everything the solution depends on: the model parameters, the
+	method and delay order, the horizon, the solver and its options, the
+	initial conditions and the sample times. A hit returns the samples
+	without integrating at all. The backend is not part of the key, as the
+	compiled kernels give the same solution.
+
+	Entries are kept in memory, evicting the least recently used beyond
+	max_memory bytes, and optionally on disk in a core.cache.ArrayCache,
+	trimmed to max_bytes.
+
+	Attributes
+	----------
+	memory : OrderedDict
+		Samples in memory by entry name, least recently used first.
+	memory_bytes : int
+		Size of the samples in memory.
+	max_memory : int
+		Size the samples in memory are trimmed to.
+	disk : ArrayCache or None
+		Entries on disk.
+	hits, misses : int
+		Lookups answered from the cache and solved.
+	'''
+
+	# Bumped whenever the model or the key changes
+	version = 1
+
+	def __init__(self, directory=None, max_memory=2**26, max_bytes=2**28):
+		'''
+		Initialise a solution cache.
+
+		Parameters
+		----------
+		directory : str, optional
+			Folder holding the entries on disk. Default is to keep entries
+			in memory only.
+		max_memory : int, optional
+			Size the samples in memory are trimmed to. Default is 64 MiB.
+		max_bytes : int, optional
+			Size the entries on disk are trimmed to. Default is 256 MiB.
+		'''
+
+		self.memory = OrderedDict()
+		self.memory_bytes = 0
+		self.max_memory = max_memory
+		self.disk = ArrayCache(directory, max_bytes) \
+		if directory is not None else None
+		self.hits = 0
+		self.misses = 0
+
+	def key(self, parameters, method, horizon, times, solver='LSODA',
+			initial_conditions=None):
+		'''
+		Canonical form of the settings that determine a solution.
+
+		Parameters
+		----------
+		parameters, method, solver, initial_conditions
+			As for SDModel. Parameters the model does not read are ignored.
+		horizon : float
+			Time the model is solved until.
+		times : array_like, shape (n,)
+			Times the dense output is sampled at.
+
+		Returns
+		-------
+		dict
+			JSON-serialisable key.
+		'''
+
+		key = {'version': self.version, 'method': method, 'solver': solver,
+			   'horizon': float(horizon),
+			   'parameters': {name: float(parameters[name])
+							  for name in PARAMETERS},
+			   'initial_conditions': None if initial_conditions is None else
+			   {name: float(value) for name, value in initial_conditions.items()},
+			   'times': hashlib.sha256(np.ascontiguousarray(
+				   times, dtype=np.float64).tobytes()).hexdigest()}
+		if method == 'LCT':
+			key['delay_order'] = int(parameters['delay_order'])
+		if solver == 'RK4':
+			key['steps_per_lag'] = int(parameters.get('steps_per_lag', 40))
+
+		return key
+
+	def entry_name(self, key):
+		'''
+		Return the hash of the canonical form of a key.
+
+		Parameters
+		----------
+		key : dict
+			Key returned by key.
+
+		Returns
+		-------
+		str
+			Hexadecimal digest.
+		'''
+
+		canonical = json.dumps(key, sort_keys=True, separators=(',', ':'))
+		return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+	def get(self, key):
+		'''
+		Look up the samples for a key, in memory and then on disk.
+
+		Parameters
+		----------
+		key : dict
+			Key returned by key.
+
+		Returns
+		-------
+		array_like, shape (4, n) or None
+			Read-only samples of S, I, Q and R, or None if there is no entry.
+		'''
+
+		name = self.entry_name(key)
+		if name in self.memory:
+			self.memory.move_to_end(name)
+			self.hits += 1
+			return self.memory[name]
+
+		arrays = self.disk.load(key) if self.disk is not None else None
+		if arrays is None:
+			return None
+		self.hits += 1
+		return self.remember(name, np.array(arrays['stocks']))
+
+	def put(self, key, samples):
+		'''
+		Store the samples for a key, in memory and on disk.
+
+		Parameters
+		----------
+		key : dict
+			Key returned by key.
+		samples : array_like, shape (4, n)
+			Samples of S, I, Q and R.
+
+		Returns
+		-------
+		array_like, shape (4, n)
+			Read-only copy of the samples kept in memory.
+		'''
+
+		samples = np.array(samples, dtype=np.float64)
+		if self.disk is not None:
+			name = self.disk.entry_name(key)
+			self.disk.store(key, {'stocks': samples})
+			self.disk.evict(keep=name)
+
+		return self.remember(self.entry_name(key), samples)
+
+	def remember(self, name, samples):
+		'''
+		Keep samples in memory, evicting the least recently used beyond
+		max_memory.
+
+		Parameters
+		----------
+		name : str
+			Entry name.
+		samples : array_like, shape (4, n)
+			Samples of S, I, Q and R.
+
+		Returns
+		-------
+		array_like, shape (4, n)
+			The samples, made read-only.
+		'''
+
+		samples.setflags(write=False)
+		if name in self.memory:
+			self.memory_bytes -= self.memory.pop(name).nbytes
+		self.memory[name] = samples
+		self.memory_bytes += samples.nbytes
+		while self.memory_bytes > self.max_memory and len(self.memory) > 1:
+			self.memory_bytes -= self.memory.popitem(last=False)[1].nbytes
+
+		return samples
+
+	def stocks(self, parameters, method, horizon, times, solver='LSODA',
+			   initial_conditions=None, backend='numpy'):
+		'''
+		Stocks of a system dynamics model at the given times, solving the
+		model only if the cache has no entry for it.
+
+		Parameters
+		----------
+		parameters, method, solver, initial_conditions, backend
+			As for SDModel.
+		horizon : float
+			Time the model is solved until.
+		times : array_like, shape (n,)
+			Times the dense output is sampled at.
+
+		Returns
+		-------
+		array_like, shape (4, n)
+			Read-only values of S, I, Q and R at the times.
+		'''
+
+		key = self.key(parameters, method, horizon, times, solver,
+					   initial_conditions)
+		samples = self.get(key)
+		if samples is None:
+			self.misses += 1
+			model = SDModel(copy.deepcopy(parameters), method,
+							initial_conditions, solver, backend)
+			model.solve(horizon)
+			samples = self.put(key, model.interpolator(times)[:4])
+
+		return samples
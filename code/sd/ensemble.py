@@ -0,0 +1,347 @@
+# Import required packages
+import numpy as np
+from scipy.integrate import solve_ivp
+from core.dense import DenseSolution
+from core.delay import DelayHistory
+from core.erlang import siqr_jacobian, LOWER_BAND, UPPER_BAND
+
+class SDEnsemble:
+	'''
+	Batch of system dynamics models solved as stacked systems of equations.
+
+	Instead of solving one SDModel after another, members sharing a
+	quarantine length are stacked into a single system and integrated by
+	one LSODA call per chunk of the method of steps, so the cost of each
+	step is spent in a few array operations rather than in Python for every
+	member. Members may use either method of modelling the pipeline delay,
+	and LCT members may use Erlang delays of different orders.
+
+	Attributes
+	----------
+	n_members : int
+		Number of models in the ensemble.
+	groups : list of StackedSDModel
+		Stacked systems, one for each distinct quarantine length.
+	members : list of array_like
+		Positions in the ensemble of the members of each group.
+	'''
+
+	def __init__(self, parameters, method, initial_conditions=None, rtol=1e-6):
+		'''
+		Initialise an ensemble of system dynamics models.
+
+		Parameters
+		----------
+		parameters : list of dict
+			Parameters of every member, as for SDModel (with delay_order for
+			LCT members).
+		method : str or list of str
+			Either 'interp' or 'LCT', for all members or for each member.
+		initial_conditions : dict or list of dict, optional
+			Initial stock values, as for SDModel, for all members or for each
+			member.
+		rtol : float, optional
+			Relative tolerance of LSODA. Error is controlled in the norm of
+			the whole stacked system. Default is 1e-6, as used by SDModel.
+		'''
+
+		self.n_members = len(parameters)
+
+		# Method and initial conditions of every member
+		if isinstance(method, str):
+			method = [method] * self.n_members
+		if initial_conditions is None or isinstance(initial_conditions, dict):
+			initial_conditions = [initial_conditions] * self.n_members
+		if len(method) != self.n_members or \
+		len(initial_conditions) != self.n_members:
+			raise ValueError('Expected one method and initial condition per '
+							 'member.')
+
+		# Stack members sharing a quarantine length
+		lags = np.array([pars['quarantine_length'] for pars in parameters])
+		self.groups = []
+		self.members = []
+		for lag in np.unique(lags):
+			members = np.flatnonzero(lags == lag)
+			self.groups.append(StackedSDModel(
+				[parameters[i] for i in members], [method[i] for i in members],
+				[initial_conditions[i] for i in members], rtol))
+			self.members.append(members)
+
+	def solve(self, t):
+		'''
+		Solves the stock differential equations of every member until time t.
+
+		Parameters
+		----------
+		t : float
+			Solve until this time.
+		'''
+
+		for group in self.groups:
+			group.solve(t)
+
+	def stocks(self, t):
+		'''
+		Stock values of every member at an array of time points.
+
+		Parameters
+		----------
+		t : array_like, shape (n_times,)
+			Time points, within the range solved.
+
+		Returns
+		-------
+		array_like, shape (n_members, 4, n_times)
+			Values of S, I, Q and R.
+		'''
+
+		t = np.asarray(t, dtype=float)
+		values = np.empty((self.n_members, 4, len(t)))
+		for group, members in zip(self.groups, self.members):
+			values[members] = group.stocks(t)
+
+		return values
+
+class StackedSDModel:
+	'''
+	System dynamics models sharing a quarantine length, stacked into one
+	system of equations.
+
+	The state of each member is stored contiguously: S, I, Q and R followed
+	by the stages of its Erlang delay (none for interp members). Chains of
+	different orders therefore need no padding, and as every member is
+	banded with lband=LOWER_BAND and uband=UPPER_BAND (see
+	core.erlang.lct_banded_jacobian), so is the stacked system.
+
+	Attributes
+	----------
+	contact_rate, infectivity, symptom_delay : array_like, shape (m,)
+		Parameters of each member.
+	quarantine_fraction, infectivity_length : array_like, shape (m,)
+		Parameters of each member.
+	quarantine_length : int or float
+		Quarantine length shared by the members.
+	delay_order : array_like, shape (m,)
+		Order of the Erlang delay of each member, 0 for interp members.
+	main : array_like, shape (m, 4)
+		Position of S, I, Q and R of each member in the state.
+	stages : array_like, shape (sum(delay_order),)
+		Position of every Erlang stage in the state.
+	t : float
+		Time solved until.
+	y : array_like, shape (n_states,)
+		State at time t.
+	interpolator : DenseSolution
+		Dense output of the stacked solution.
+	'''
+
+	def __init__(self, parameters, method, initial_conditions, rtol=1e-6):
+		'''
+		Initialise a stacked system.
+
+		Parameters
+		----------
+		parameters : list of dict
+			Parameters of every member, with equal quarantine_length.
+		method : list of str
+			Either 'interp' or 'LCT' for each member.
+		initial_conditions : list of dict or None
+			Initial stock values of each member, or None to start from a
+			single infection.
+		rtol : float, optional
+			Relative tolerance of LSODA. Default is 1e-6.
+		'''
+
+		# Parameters of each member
+		for name in ['contact_rate', 'infectivity', 'symptom_delay',
+					 'quarantine_fraction', 'infectivity_length']:
+			setattr(self, name, np.array([pars[name] for pars in parameters],
+										 dtype=float))
+		self.quarantine_length = parameters[0]['quarantine_length']
+		self.rtol = rtol
+
+		# Order of the Erlang delay of each member
+		orders = []
+		for pars, name in zip(parameters, method):
+			if name == 'LCT':
+				if isinstance(pars['delay_order'], int) == False:
+					raise ValueError('Order must be an integer.')
+				orders.append(pars['delay_order'])
+			elif name == 'interp':
+				orders.append(0)
+			else:
+				raise ValueError('Method must either be chain or interp.')
+		self.delay_order = np.array(orders, dtype=int)
+
+		# Position of every stock in the state
+		sizes = 4 + self.delay_order
+		offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+		self.n_states = int(np.sum(sizes))
+		self.main = offsets[:, None] + np.arange(4)
+		self.lct = np.flatnonzero(self.delay_order > 0)
+		self.interp = np.flatnonzero(self.delay_order == 0)
+
+		# Erlang stages, with their rates and the first and last of each chain
+		orders = self.delay_order[self.lct]
+		ends = np.cumsum(orders)
+		self.first = ends - orders
+		self.last = ends - 1
+		self.stages = np.repeat(offsets[self.lct] + 4 - self.first, orders) + \
+		np.arange(ends[-1] if len(ends) else 0)
+		self.a = np.repeat(orders / self.quarantine_length, orders)
+		self.preceding = np.setdiff1d(np.arange(len(self.stages)), self.last)
+
+		# Initial conditions
+		self.t = 0
+		self.y = np.zeros(self.n_states)
+		for main, pars, initial in zip(self.main, parameters,
+									   initial_conditions):
+			if initial:
+				self.y[main] = [initial['susceptible'], initial['infected'],
+								initial['quarantined'], initial['recovered']]
+			else:
+				self.y[main] = [pars['population'] - 1, 1, 0, 0]
+
+		# Interpolator and lagged infections of the interp members
+		self.interpolator = None
+		self.delayed_infections = None
+
+	def stock_equations(self, t, y):
+		'''
+		Calculates rate of change in stock of every member at time t.
+
+		Parameters
+		----------
+		t : float
+			Current time point.
+		y : array_like, shape (n_states,)
+			Stacked state at time t.
+
+		Returns
+		-------
+		array_like, shape (n_states,)
+			Differential equation values at time t.
+		'''
+
+		# Main stocks
+		S, I, Q, R = y[self.main].T
+
+		# Standard flows
+		IR = (self.contact_rate * self.infectivity * S * I) / (S + I + R)
+		IRR = ((1-self.quarantine_fraction) * I) / self.infectivity_length
+		QR = (self.quarantine_fraction * I) / self.symptom_delay
+
+		# Erlang chains, each fed by the quarantine rate of its member
+		outflow = np.zeros(len(S))
+		flows = self.a * y[self.stages]
+		dZdt = np.empty_like(flows)
+		dZdt[self.first] = QR[self.lct]
+		dZdt[self.preceding + 1] = flows[self.preceding]
+		dZdt -= flows
+		outflow[self.lct] = flows[self.last]
+
+		# Lagged infections
+		t_delay = t - self.quarantine_length
+		if len(self.interp) and t_delay >= 0:
+			I_delay = self.delayed_infections(t_delay)
+			outflow[self.interp] = (self.quarantine_fraction[self.interp] *
+									I_delay) / self.symptom_delay[self.interp]
+
+		# Stock equations
+		dydt = np.empty_like(y)
+		dydt[self.main[:, 0]] = - IR
+		dydt[self.main[:, 1]] = IR - IRR - QR
+		dydt[self.main[:, 2]] = QR - outflow
+		dydt[self.main[:, 3]] = IRR + outflow
+		dydt[self.stages] = dZdt
+
+		return dydt
+
+	def jacobian(self, t, y):
+		'''
+		Banded Jacobian of the stacked stock equations.
+
+		Parameters
+		----------
+		t : float
+			Current time point.
+		y : array_like, shape (n_states,)
+			Stacked state at time t.
+
+		Returns
+		-------
+		array_like, shape (7, n_states)
+			Packed banded Jacobian, one core.erlang.lct_banded_jacobian per
+			member side by side.
+		'''
+
+		block = siqr_jacobian(y[self.main].T, self.contact_rate,
+							  self.infectivity, self.quarantine_fraction,
+							  self.infectivity_length, self.symptom_delay)
+
+		packed = np.zeros((LOWER_BAND + UPPER_BAND + 1, self.n_states))
+
+		# Main block of every member
+		for i in range(4):
+			for j in range(4):
+				packed[UPPER_BAND + i - j, self.main[:, j]] = block[i, j]
+
+		# First stages fed by I, then the bidiagonal chains
+		packed[UPPER_BAND + 3, self.main[self.lct, 1]] = block[2, 1, self.lct]
+		packed[UPPER_BAND, self.stages] = -self.a
+		packed[UPPER_BAND + 1, self.stages[self.preceding]] = \
+		self.a[self.preceding]
+
+		return packed
+
+	def solve(self, t):
+		'''
+		Solves the stacked stock differential equations until time t.
+
+		Parameters
+		----------
+		t : float
+			Solve until this time.
+		'''
+
+		while self.t < t:
+			# Solve until...
+			tmax = min(self.t + self.quarantine_length - 1, t)
+
+			# Solve stock equations
+			solutions = solve_ivp(self.stock_equations, [self.t, tmax], self.y,
+								  dense_output=True, method='LSODA',
+								  rtol=self.rtol, jac=self.jacobian,
+								  lband=LOWER_BAND, uband=UPPER_BAND)
+
+			# Update interpolator
+			if self.interpolator:
+				self.interpolator.extend(solutions.sol.ts,
+										 solutions.sol.interpolants)
+			else:
+				self.interpolator = DenseSolution(solutions.sol.ts,
+												  solutions.sol.interpolants)
+				self.delayed_infections = DelayHistory(
+					self.interpolator, self.main[self.interp, 1])
+
+			# Update stock values
+			self.y = solutions.y[:, -1]
+			self.t = tmax
+
+	def stocks(self, t):
+		'''
+		Stock values of every member at an array of time points.
+
+		Parameters
+		----------
+		t : array_like, shape (n_times,)
+			Time points, within the range solved.
+
+		Returns
+		-------
+		array_like, shape (m, 4, n_times)
+			Values of S, I, Q and R.
+		'''
+
+		return self.interpolator(t)[self.main]
@@ -1,6 +1,13 @@
 # Import required packages
 import numpy as np
-from scipy.integrate import solve_ivp, OdeSolution
+from scipy.integrate import solve_ivp
+from core.history import History
+from core.dense import DenseSolution
+from core.delay import DelayHistory
+from core.fixed_step import FixedStepDelaySolver
+from core.erlang import (erlang_chain, siqr_jacobian, lct_banded_jacobian,
+						 LOWER_BAND, UPPER_BAND)
+from core.kernels import resolve_backend, kernels
 
 class SDModel:
 	'''
@@ -32,6 +39,17 @@ class SDModel:
 		Number of recovered individuals at each time point in time.
 	time : array_like, shape (n,)
 		Time points at which the equations have been solved.
+	stock_history : History
+		Stock values (S, I, Q, R) at each time point, read through S, I, Q
+		and R.
+	stage_history : History
+		Intermediate stocks of the LCT approach at each time point, read
+		through Z.
+	time_history : History
+		Time points, read through time.
+	backend : str
+		Either 'numpy' (the default) or 'numba', which evaluates the stock
+		equations with a compiled kernel.
 
 	Notes
 	-----
@@ -45,7 +63,8 @@ class SDModel:
 	pp. 240–256. doi: 10.1080/17477778.2021.1992312.
 	'''
 
-	def __init__(self, parameters, method, initial_conditions=None):
+	def __init__(self, parameters, method, initial_conditions=None,
+				 solver='LSODA', backend='numpy'):
 		'''
 		Initialise a system dynamics model.
 
@@ -54,10 +73,17 @@ class SDModel:
 		parameters : dict
 			Dictionary containing values for contact_rate, infectivity,
 			symptom_delay, quarantine_length, vaccine_uptake, 
-			quarantine_fraction, infectivity_length, population.
+			quarantine_fraction, infectivity_length, population and, for the
+			RK4 solver, optionally steps_per_lag.
 		initial_conditions : dict, optional
 			Dicitionary containing initial stock values for susceptible,
 			infected, quarantined and recovered individuals.
+		solver : str, optional
+			Either 'LSODA' (adaptive, the default) or 'RK4' (fixed step, interp
+			method only).
+		backend : str, optional
+			Either 'numpy' (the default), 'numba' or 'auto' (numba if it is
+			installed); see core.kernels.resolve_backend.
 		'''
 
 		# Inherit interpolator class
@@ -78,35 +104,105 @@ class SDModel:
 		else: 
 			raise ValueError('Method must either be chain or interp.')
 
+		# Solver for the stock equations
+		if solver == 'LSODA' or (solver == 'RK4' and self.method == 'interp'):
+			self.solver = solver
+		else:
+			raise ValueError('Solver must either be LSODA or RK4 (interp only).')
+		if self.solver == 'RK4':
+			self.steps_per_lag = parameters.get('steps_per_lag', 40)
+		self.fixed_step_solver = None
+
+		# Backend evaluating the stock equations
+		self.backend = resolve_backend(backend)
+
 		if self.method == 'LCT':
 			self.delay_order = parameters['delay_order']
 			self.a = self.delay_order / self.quarantine_length
-			# self.Z = np.zeros(self.delay_order - 1)
-			self.Z = np.zeros(self.delay_order)
-			# self.Z = self.Z.reshape((1,self.delay_order - 1))
-			self.Z = self.Z.reshape((1,self.delay_order))
+			self.stage_history = History(np.zeros(self.delay_order))
 			if isinstance(self.delay_order, int) == False:
 				raise ValueError('Order must be an integer.')
 			
 		# Initial_conditions
 		if initial_conditions:
-			self.S = np.array([initial_conditions['susceptible']])
-			self.I = np.array([initial_conditions['infected']])
-			self.Q = np.array([initial_conditions['quarantined']])
-			self.R = np.array([initial_conditions['recovered']])
+			self.stock_history = History([initial_conditions['susceptible'],
+										  initial_conditions['infected'],
+										  initial_conditions['quarantined'],
+										  initial_conditions['recovered']])
 		else:
-			self.S = np.array([self.population - 1])
-			self.I = np.array([1])
-			self.Q = np.array([0])
-			self.R = np.array([0])
+			self.stock_history = History([self.population - 1, 1, 0, 0])
 
 		# Store timepoints
-		self.time = np.array([0])
+		self.time_history = History(0)
 
-		# Interpolator
+		# Interpolator and lagged infections
 		self.interpolator = None
+		self.delayed_infections = None
+
+	@property
+	def S(self):
+		'''
+		Number of susceptible individuals at each time point.
+		'''
+
+		return self.stock_history.view[:,0]
+
+	@property
+	def I(self):
+		'''
+		Number of infected individuals at each time point.
+		'''
+
+		return self.stock_history.view[:,1]
+
+	@property
+	def Q(self):
+		'''
+		Number of quarantined individuals at each time point.
+		'''
+
+		return self.stock_history.view[:,2]
+
+	@property
+	def R(self):
+		'''
+		Number of recovered individuals at each time point.
+		'''
+
+		return self.stock_history.view[:,3]
 
-	def stock_equations(self, t, y):
+	@property
+	def Z(self):
+		'''
+		Intermediate stocks of the LCT approach at each time point.
+		'''
+
+		return self.stage_history.view
+
+	@property
+	def time(self):
+		'''
+		Time points at which the equations have been solved.
+		'''
+
+		return self.time_history.view
+
+	def reserve_history(self, rows):
+		'''
+		Preallocate the stock histories.
+
+		Parameters
+		----------
+		rows : int
+			Total number of time points expected.
+		'''
+
+		self.stock_history.reserve(rows)
+		self.time_history.reserve(rows)
+		if self.method == 'LCT':
+			self.stage_history.reserve(rows)
+
+	def stock_equations(self, t, y, I_delay=None):
 		'''
 		Calculates rate of change in stock at time t.
 
@@ -116,6 +212,10 @@ class SDModel:
 			Current time point. 
 		y : array_like, shape (4,)
 			Stock values at time t.
+		I_delay : float, optional
+			Infections at t - quarantine_length for the interp method (0
+			before the delay has elapsed). Looked up from the interpolator if
+			not given.
 
 		Returns
 		-------
@@ -123,6 +223,9 @@ class SDModel:
 			Differential equation values at time t.
 		'''
 
+		if self.backend == 'numba':
+			return self.compiled_equations(t, y, I_delay)
+
 		# Main stocks
 		S, I, Q, R = y[:4]
 
@@ -132,18 +235,14 @@ class SDModel:
 		QR = (self.quarantine_fraction * I) / self.symptom_delay
 
 		if self.method=='LCT':
-			Z = y[4:]
-			dZdt = np.zeros(self.delay_order)
-			outflow = QR
-			for i in range(self.delay_order):
-				inflow = outflow
-				outflow = self.a * Z[i]
-				dZdt[i] = inflow - outflow
-
-		if self.method=='interp':			
+			dZdt, outflow = erlang_chain(y[4:], QR, self.a)
+
+		if self.method=='interp' and I_delay is not None:
+			outflow = (self.quarantine_fraction * I_delay) / self.symptom_delay
+		elif self.method=='interp':			
 			t_delay = t - self.quarantine_length
 			if t_delay >= 0:
-				I_delay = self.interpolator(t_delay)[1] 
+				I_delay = self.delayed_infections(t_delay)
 				outflow = (self.quarantine_fraction * I_delay) / self.symptom_delay
 			else:
 				outflow = 0
@@ -160,6 +259,54 @@ class SDModel:
 
 		return output
 
+	def compiled_equations(self, t, y, I_delay=None):
+		'''
+		Rate of change in stock at time t, from the compiled kernel.
+
+		Parameters are as for stock_equations; the lagged infections of the
+		interp method are looked up here and passed in.
+		'''
+
+		rate, outflow = 0.0, 0.0
+		if self.method == 'LCT':
+			rate = self.a
+		elif I_delay is None and t - self.quarantine_length >= 0:
+			I_delay = self.delayed_infections(t - self.quarantine_length)
+		if I_delay is not None:
+			outflow = (self.quarantine_fraction * float(I_delay)) / \
+			self.symptom_delay
+
+		return kernels()['siqr_rhs'](y, self.contact_rate, self.infectivity,
+									 self.quarantine_fraction,
+									 self.infectivity_length,
+									 self.symptom_delay, 0.0, rate, outflow)
+
+	def jacobian(self, t, y):
+		'''
+		Jacobian of the stock equations for the LCT method.
+
+		Passed to LSODA in banded form, so the cost of each factorisation
+		grows linearly with the delay order.
+
+		Parameters
+		----------
+		t : float
+			Current time point.
+		y : array_like, shape (4+delay_order,)
+			Stock values at time t.
+
+		Returns
+		-------
+		array_like, shape (7, 4+delay_order)
+			Packed banded Jacobian (see core.erlang.lct_banded_jacobian).
+		'''
+
+		block = siqr_jacobian(y, self.contact_rate, self.infectivity,
+							  self.quarantine_fraction, self.infectivity_length,
+							  self.symptom_delay)
+
+		return lct_banded_jacobian(block, self.delay_order, self.a)
+
 	def solve(self, t):
 		'''
 		Solves the stock differential equations until time t.
@@ -168,12 +315,16 @@ class SDModel:
 		----------
 		t : float
 			Solve until this time.
-		method : str
-			Method for solving. 
-		rtol : float
-			Controls relative accuracy when using solve_ivp.
 		'''
 
+		if self.solver == 'RK4':
+			self.solve_fixed_step(t)
+			return
+
+		# Preallocate one row per chunk of the method of steps
+		chunks = np.ceil((t - self.time[-1]) / (self.quarantine_length - 1))
+		self.reserve_history(len(self.time_history) + max(int(chunks), 0))
+
 		while self.time[-1] < t:
 			# Solve until...
 			tmax = min(self.time[-1] + self.quarantine_length - 1, t)
@@ -186,28 +337,58 @@ class SDModel:
 			# Time domain
 			time_domain = [self.time[-1], tmax]
 		
+			# Banded Jacobian for the LCT method
+			if self.method=='LCT':
+				options = {'jac': self.jacobian, 'lband': LOWER_BAND,
+						   'uband': UPPER_BAND}
+			else:
+				options = {}
+		
 			# Solve stock equations
 			solutions = solve_ivp(self.stock_equations, time_domain, y0, 
-								  dense_output=True, method='LSODA', rtol=1e-6)
+								  dense_output=True, method='LSODA', rtol=1e-6,
+								  **options)
 	
 			# Update interpolator
 			if self.interpolator: 
-				# Extract and append time points
-				ts = np.append(self.interpolator.ts, solutions.sol.ts[1:])
-				# Extract and append list of interpolant objects
-				interpolants = self.interpolator.interpolants + solutions.sol.interpolants
-				# Create new OdeSolution object
-				self.interpolator = OdeSolution(ts, interpolants)
+				# Append the new steps
+				self.interpolator.extend(solutions.sol.ts,
+										 solutions.sol.interpolants)
 			else: 
-				# If the first time, we can just store the solve_ivp sol output
-				self.interpolator = solutions.sol
+				self.interpolator = DenseSolution(solutions.sol.ts,
+												  solutions.sol.interpolants)
+				self.delayed_infections = DelayHistory(self.interpolator, 1)
 			
 			# Update stock values
-			self.S = np.append(self.S, solutions.y[0,-1])
-			self.I = np.append(self.I, solutions.y[1,-1])
-			self.Q = np.append(self.Q, solutions.y[2,-1])
-			self.R = np.append(self.R, solutions.y[3,-1])
+			self.stock_history.append(solutions.y[:4,-1])
 			if self.method=='LCT':
-				self.Z = np.vstack((self.Z, solutions.y[4:,-1]))
-			self.time = np.append(self.time, tmax)
-		
\ No newline at end of file
+				self.stage_history.append(solutions.y[4:,-1])
+			self.time_history.append(tmax)
+
+	def solve_fixed_step(self, t):
+		'''
+		Solves the stock differential equations until time t with fixed-step
+		RK4 on a grid of steps_per_lag steps per quarantine_length.
+
+		Parameters
+		----------
+		t : float
+			Solve until this time; must lie on the grid.
+		'''
+
+		if self.fixed_step_solver is None:
+			y0 = [self.S[-1], self.I[-1], self.Q[-1], self.R[-1]]
+			self.fixed_step_solver = FixedStepDelaySolver(
+				self.stock_equations, self.time[-1], y0, self.quarantine_length,
+				self.steps_per_lag)
+		solver = self.fixed_step_solver
+
+		# Record the stocks at every grid point
+		start = solver.steps
+		solver.advance(t)
+		self.reserve_history(len(self.time_history) + solver.steps - start)
+		for i in range(start + 1, solver.steps + 1):
+			self.stock_history.append(solver.ys.data[i])
+			self.time_history.append(solver.ts.data[i])
+
+		self.interpolator = solver.dense_output()
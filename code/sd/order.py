@@ -0,0 +1,148 @@
+# Import required packages / files
+import copy
+import math
+import time
+import warnings
+import numpy as np
+from sd.model import SDModel
+from sd.cache import SolutionCache
+
+# Order of the stocks in the samples of a solution
+STOCKS = 'SIQR'
+
+def order_error(parameters, order, stock='Q', horizon=80, times=None,
+				cache=None):
+	'''
+	Error of the Erlang (LCT) approximation of the delay against the
+	interpolation method.
+
+	Parameters
+	----------
+	parameters : dict
+		Parameters of the system dynamics model (see SDModel).
+	order : int
+		Order of the Erlang delay.
+	stock : str, optional
+		Stock compared, one of S, I, Q and R. Default is Q.
+	horizon : float, optional
+		Time the models are solved until. Default is 80.
+	times : array_like, shape (n,), optional
+		Times compared. Default is 1001 points from 0 to the horizon.
+	cache : SolutionCache, optional
+		Cache of solutions, so the reference is solved once. Default is a
+		new in-memory cache.
+
+	Returns
+	-------
+	float
+		Largest absolute difference in the stock over the times.
+	'''
+
+	if stock not in STOCKS:
+		raise ValueError('Stock must be S, I, Q or R.')
+	times = np.linspace(0, horizon, 1001) if times is None else times
+	cache = SolutionCache() if cache is None else cache
+
+	reference = cache.stocks(parameters, 'interp', horizon, times)
+	erlang = cache.stocks(dict(parameters, delay_order=int(order)), 'LCT',
+						  horizon, times)
+	i = STOCKS.index(stock)
+
+	return float(np.max(np.abs(erlang[i] - reference[i])))
+
+def select_delay_order(parameters, tolerance, stock='Q', horizon=80,
+					   times=None, max_order=1000, cache=None):
+	'''
+	Cheapest order of the Erlang delay whose error against interpolation
+	is within a tolerance.
+
+	The error falls as a power of the order and the cost grows with it, so
+	the cheapest order is the smallest that meets the tolerance. It is
+	found by bracketing: each step predicts the order from a power law
+	through the two closest orders evaluated, and a bisection step (at the
+	geometric mean of the bracket, as the error follows a power law) is
+	taken instead whenever a prediction fails to halve the bracket, so few
+	solves are needed. Every solve goes through the cache.
+
+	Parameters
+	----------
+	parameters : dict
+		Parameters of the system dynamics model (see SDModel).
+	tolerance : float
+		Largest absolute error in the stock allowed.
+	stock, horizon, times, cache : optional
+		As for order_error.
+	max_order : int, optional
+		Largest order considered. Default is 1000.
+
+	Returns
+	-------
+	dict
+		delay_order, the order chosen; error, its error; cost, the wall
+		time in seconds of solving the model with that order; tolerance and
+		stock; and errors, the error of every order evaluated.
+	'''
+
+	if tolerance <= 0:
+		raise ValueError('Tolerance must be positive.')
+	times = np.linspace(0, horizon, 1001) if times is None else times
+	cache = SolutionCache() if cache is None else cache
+	cache.stocks(parameters, 'interp', horizon, times)
+
+	# Error of an order, and the time taken to solve it if not cached
+	errors = {}
+	costs = {}
+	def evaluate(order):
+		misses = cache.misses
+		start = time.perf_counter()
+		errors[order] = order_error(parameters, order, stock, horizon, times,
+									cache)
+		if cache.misses > misses:
+			costs[order] = time.perf_counter() - start
+		return errors[order]
+
+	# Bracket the order: lo fails the tolerance and hi meets it, with
+	# max_order + 1 standing for no order meeting it
+	lo, hi = 0, max_order + 1
+	order, bisect = 1, True
+	while hi - lo > 1:
+		width = hi - lo
+		if evaluate(order) <= tolerance:
+			hi = order
+		else:
+			lo = order
+		bisect = not bisect and 2 * (hi - lo) > width
+
+		# Power law through the ends of the bracket, or the orders closest
+		# to the last one (error inversely proportional to the order if
+		# only one is known)
+		if lo in errors and hi in errors:
+			points = [lo, hi]
+		else:
+			points = sorted(errors, key=lambda n: abs(math.log(n / order)))[:2]
+		power = 1
+		if len(points) == 2:
+			(n1, n2), (e1, e2) = points, [errors[n] for n in points]
+			power = math.log(e1 / e2) / math.log(n2 / n1) if e1 != e2 else 0
+		if bisect or power <= 0:
+			guess = math.isqrt(lo * hi)
+		else:
+			guess = math.ceil(order * (errors[order] / tolerance) ** (1 / power))
+		order = min(max(guess, lo + 1), hi - 1)
+
+	if hi > max_order:
+		warnings.warn(f'No delay order up to {max_order} meets the tolerance.')
+		hi = max_order
+		if hi not in errors:
+			evaluate(hi)
+
+	# Cost of the order chosen, timed on its own if its solve was cached
+	if hi not in costs:
+		model = SDModel(copy.deepcopy(dict(parameters, delay_order=hi)), 'LCT')
+		start = time.perf_counter()
+		model.solve(horizon)
+		costs[hi] = time.perf_counter() - start
+
+	return {'delay_order': hi, 'error': errors[hi], 'cost': costs[hi],
+			'tolerance': tolerance, 'stock': stock,
+			'errors': dict(sorted(errors.items()))}